@@ -0,0 +1,282 @@
+# JSON API over the same rankings and SPOKE path queries the Streamlit apps
+# serve, for programmatic clients:
+#
+#   python api_server.py [--port 8502]
+#
+#   GET /api/compounds?source=bcmm|dwpc
+#   GET /api/compounds/<name>/bacteria?source=bcmm&sort_key=embedding&limit=25&offset=0
+#   GET /api/bacteria/<ncbi_id>/compounds?sort_key=embedding&limit=25&offset=0
+#   GET /api/paths?organism=<ncbi id>&compound=<spoke identifier>
+#   GET /api/metapaths?organism=<ncbi id>&compound=<spoke identifier>
+#
+# Ranking requests are answered on the event loop from the memmapped stores
+# and rank indexes; SPOKE queries run on a thread pool against the pooled
+# driver from netvis. Identical requests in flight at the same time share one
+# computation and one serialized response.
+import os
+import json
+import math
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import tornado.web
+from neo4j.exceptions import DriverError, Neo4jError
+from compound_index import DWPC_COMPOUNDS_PATH, get_compound_index
+from data_store import EXCLUDED_COMPOUNDS, get_bcmm_store, get_dwpc_store
+from metrics import timed
+from path_cache import PartialResult
+from ranking import BCMM_SORT_KEYS, build_bcmm_rank_index, build_dwpc_rank_index, get_rank_index, ranked_bacteria_table, ranked_compound_table, ranked_dwpc_table, compound_rows
+from netvis import (
+    SPOKE_MAX_POOL_SIZE, SPOKE_METAPATH_WORKERS, SPOKE_QUERY_TIMEOUT, _metapath_executor, _node_name_v2,
+    create_visjs_payload, fetch_path, fetch_path_from_metapath, get_driver, load_metapath_queries,
+)
+
+
+BCMM_API_PORT = int(os.environ.get("BCMM_API_PORT", 8502))
+BCMM_API_DEFAULT_LIMIT = 25
+BCMM_API_MAX_LIMIT = int(os.environ.get("BCMM_API_MAX_LIMIT", 1000))
+METAPATH_PATH = "data/org_cmp_manually_selected_metapath.csv"
+SOURCES = ["bcmm", "dwpc"]
+
+
+class ApiError(tornado.web.HTTPError):
+    # Rendered by ApiHandler.write_error as {"error": message}. The message
+    # often echoes user input, so it stays out of the status line (CR/LF or
+    # non-ASCII there breaks the response); the reason is the standard one.
+    def __init__(self, status, message):
+        super().__init__(status)
+        self.message = message
+
+
+class Coalescer:
+    # One in-flight future per key; concurrent callers with the same key
+    # await it instead of recomputing. Finished keys are dropped, so this is
+    # not a cache.
+    def __init__(self):
+        self.in_flight = {}
+
+    async def run(self, key, compute):
+        future = self.in_flight.get(key)
+        if future is None:
+            future = self.in_flight[key] = asyncio.ensure_future(compute())
+            future.add_done_callback(lambda done: self.in_flight.pop(key, None))
+        return await asyncio.shield(future)
+
+
+class QueryService:
+    def __init__(self, spoke_workers=SPOKE_MAX_POOL_SIZE):
+        self.store = get_bcmm_store()
+        self.rank_index = get_rank_index("bcmm", lambda: build_bcmm_rank_index(self.store))
+        self.compound_names = sorted(set(self.store.compound_names) - set(EXCLUDED_COMPOUNDS))
+        self.compound_rows = compound_rows(self.store, self.compound_names)
+        self.dwpc_store = get_dwpc_store()
+        self.dwpc_rank_index = get_rank_index("dwpc", lambda: build_dwpc_rank_index(self.dwpc_store))
+        self.dwpc_compound_index = get_compound_index(DWPC_COMPOUNDS_PATH)
+        self.metapath_queries = load_metapath_queries(METAPATH_PATH)
+        self.spoke_executor = ThreadPoolExecutor(max_workers=spoke_workers, thread_name_prefix="api-spoke")
+        self.coalescer = Coalescer()
+
+    def compounds(self, source):
+        names = self.compound_names if source == "bcmm" else self.dwpc_compound_index.compound_names
+        return _dumps({"source": source, "compounds": names})
+
+    @timed("api.bacteria_table")
+    def bacteria_table(self, source, compound_name, sort_key, limit, offset):
+        if source == "bcmm":
+            if compound_name not in self.store.compound_index or compound_name in EXCLUDED_COMPOUNDS:
+                raise ApiError(404, "Unknown compound: {}".format(compound_name))
+            if sort_key not in BCMM_SORT_KEYS:
+                raise ApiError(400, "sort_key must be one of {}".format(", ".join(BCMM_SORT_KEYS)))
+            table = ranked_bacteria_table(self.store, self.rank_index, compound_name, sort_key, offset + limit)
+            total = self.store.n_bacteria
+        else:
+            cmp_index = self.dwpc_compound_index.column(compound_name)
+            if cmp_index is None:
+                raise ApiError(404, "Unknown compound: {}".format(compound_name))
+            if sort_key != "dwpc":
+                raise ApiError(400, "sort_key must be dwpc")
+            table = ranked_dwpc_table(self.dwpc_store, self.dwpc_rank_index, cmp_index, offset + limit)
+            table = table.rename(columns={"spoke_id": "ncbi_id", "spoke_name": "name"})
+            total = self.dwpc_store.n_bacteria
+        meta = {"source": source, "compound": compound_name, "sort_key": sort_key, "total": total, "offset": offset, "limit": limit}
+        return _dumps_with_rows(meta, table.iloc[offset:])
+
+    @timed("api.compound_table")
+    def compound_table(self, ncbi_id, sort_key, limit, offset):
+        if ncbi_id not in self.store.bacterium_index:
+            raise ApiError(404, "Unknown NCBI ID: {}".format(ncbi_id))
+        if sort_key not in BCMM_SORT_KEYS:
+            raise ApiError(400, "sort_key must be one of {}".format(", ".join(BCMM_SORT_KEYS)))
+        table = ranked_compound_table(self.store, ncbi_id, sort_key, offset + limit, compound_rows=self.compound_rows)
+        meta = {"ncbi_id": ncbi_id, "sort_key": sort_key, "total": len(self.compound_names), "offset": offset, "limit": limit}
+        return _dumps_with_rows(meta, table.iloc[offset:])
+
+    def path_graph(self, organism_id, compound_id):
+        driver = get_driver()
+        paths = fetch_path(driver, int(organism_id), compound_id)
+        payload, legend_color_map = create_visjs_payload(paths)
+        return _dumps(dict(payload, organism=organism_id, compound=compound_id, partial=isinstance(paths, PartialResult)))
+
+    async def metapath_graph(self, organism_id, compound_id):
+        driver = get_driver()
+        futures = [
+            asyncio.wrap_future(_metapath_executor.submit(fetch_path_from_metapath, driver, int(organism_id), compound_id, metapath_query))
+            for metapath_query in self.metapath_queries
+        ]
+        # Same overall budget as metapath_based_network_vis.
+        waves = math.ceil(len(futures) / SPOKE_METAPATH_WORKERS)
+        done, pending = await asyncio.wait(futures, timeout=SPOKE_QUERY_TIMEOUT * waves)
+        for future in pending:
+            future.cancel()
+        paths = []
+        failed = len(pending)
+        for future in futures:
+            if future in pending:
+                continue
+            if future.exception() is not None:
+                if not isinstance(future.exception(), (DriverError, Neo4jError)):
+                    raise future.exception()
+                failed += 1
+            elif future.result():
+                paths.append(future.result())
+        payload, legend_color_map = create_visjs_payload(paths, node_name=_node_name_v2)
+        return _dumps(dict(payload, organism=organism_id, compound=compound_id, failed_queries=failed, partial=failed > 0))
+
+    async def run_spoke(self, func, *args):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.spoke_executor, func, *args)
+        except (DriverError, Neo4jError) as error:
+            raise ApiError(503, "SPOKE query failed: {}".format(error))
+
+
+class ApiHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def write_error(self, status_code, **kwargs):
+        error = kwargs["exc_info"][1] if "exc_info" in kwargs else None
+        self.set_header("Content-Type", "application/json")
+        self.finish(_dumps({"error": getattr(error, "message", self._reason)}))
+
+    def page(self):
+        try:
+            limit = int(self.get_query_argument("limit", BCMM_API_DEFAULT_LIMIT))
+            offset = int(self.get_query_argument("offset", 0))
+        except ValueError:
+            raise ApiError(400, "limit and offset must be integers")
+        if not 1 <= limit <= BCMM_API_MAX_LIMIT or offset < 0:
+            raise ApiError(400, "limit must be in 1..{} and offset >= 0".format(BCMM_API_MAX_LIMIT))
+        return limit, offset
+
+    def source(self):
+        source = self.get_query_argument("source", "bcmm")
+        if source not in SOURCES:
+            raise ApiError(400, "source must be one of {}".format(", ".join(SOURCES)))
+        return source
+
+    def spoke_ids(self):
+        organism_id = self.get_query_argument("organism", "").strip()
+        compound_id = self.get_query_argument("compound", "").strip()
+        if not organism_id.isdigit() or not compound_id:
+            raise ApiError(400, "organism (NCBI ID) and compound (SPOKE identifier) are required")
+        return organism_id, compound_id
+
+    async def respond(self, key, compute):
+        body = await self.service.coalescer.run(key, compute)
+        self.set_header("Content-Type", "application/json")
+        self.finish(body)
+
+
+class CompoundsHandler(ApiHandler):
+    async def get(self):
+        source = self.source()
+
+        async def compute():
+            return self.service.compounds(source)
+
+        await self.respond(("compounds", source), compute)
+
+
+class BacteriaTableHandler(ApiHandler):
+    async def get(self, compound_name):
+        source = self.source()
+        sort_key = self.get_query_argument("sort_key", "embedding" if source == "bcmm" else "dwpc")
+        limit, offset = self.page()
+        args = (source, compound_name, sort_key, limit, offset)
+
+        async def compute():
+            return self.service.bacteria_table(*args)
+
+        await self.respond(("bacteria",) + args, compute)
+
+
+class CompoundTableHandler(ApiHandler):
+    async def get(self, ncbi_id):
+        sort_key = self.get_query_argument("sort_key", "embedding")
+        limit, offset = self.page()
+        args = (ncbi_id, sort_key, limit, offset)
+
+        async def compute():
+            return self.service.compound_table(*args)
+
+        await self.respond(("compounds_for",) + args, compute)
+
+
+class PathHandler(ApiHandler):
+    async def get(self):
+        args = self.spoke_ids()
+
+        async def compute():
+            return await self.service.run_spoke(self.service.path_graph, *args)
+
+        await self.respond(("paths",) + args, compute)
+
+
+class MetapathHandler(ApiHandler):
+    async def get(self):
+        args = self.spoke_ids()
+
+        async def compute():
+            try:
+                return await self.service.metapath_graph(*args)
+            except (DriverError, Neo4jError) as error:
+                raise ApiError(503, "SPOKE query failed: {}".format(error))
+
+        await self.respond(("metapaths",) + args, compute)
+
+
+def make_app(service=None):
+    service = service or QueryService()
+    handler_args = {"service": service}
+    return tornado.web.Application([
+        (r"/api/compounds", CompoundsHandler, handler_args),
+        (r"/api/compounds/([^/]+)/bacteria", BacteriaTableHandler, handler_args),
+        (r"/api/bacteria/([^/]+)/compounds", CompoundTableHandler, handler_args),
+        (r"/api/paths", PathHandler, handler_args),
+        (r"/api/metapaths", MetapathHandler, handler_args),
+    ])
+
+
+def _dumps(value):
+    return json.dumps(value, default=str)
+
+
+def _dumps_with_rows(meta, table):
+    # DataFrame.to_json handles numpy scalars and NaN (as null) in one pass.
+    return _dumps(meta)[:-1] + ', "rows": ' + table.to_json(orient="records") + "}"
+
+
+async def serve(port):
+    make_app().listen(port)
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve BCMM rankings and SPOKE paths as JSON.")
+    parser.add_argument("--port", type=int, default=BCMM_API_PORT)
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.port))
+
+
+if __name__ == "__main__":
+    main()
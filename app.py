@@ -1,7 +1,14 @@
 import streamlit as st
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
-import pickle
-import plotly.express as px
+from compound_index import BCMM_COMPOUNDS_PATH, get_compound_index, get_search_term
+from data_store import EXCLUDED_COMPOUNDS, get_bcmm_store
+from metrics import record_size, timed
+from permutation import background_p_values, background_rows, parse_ncbi_ids
+from ranking import SIGNIFICANCE_LEVEL, build_bcmm_rank_index, get_rank_index, ranked_bacteria_table, ranked_compound_table, compare_compounds_table, top_k_positions
 import plotly.graph_objects as go
 
 
@@ -14,75 +21,161 @@ FIG_WIDTH = 500
 FIG_HEIGHT = 700
 FONT_SIZE = 18
 LEGEND_SIZE = 12
+SIGNIFICANT_COLOR = "red"
+NOT_SIGNIFICANT_COLOR = "gray"
+FIGURE_CACHE_SIZE = int(os.environ.get("BCMM_FIGURE_CACHE_SIZE", 64))
+# 0 plots every bacterium; otherwise non-significant points are thinned in
+# dense regions down to about this many (significant ones are always kept).
+PLOT_MAX_BACKGROUND_POINTS = int(os.environ.get("BCMM_PLOT_MAX_BACKGROUND_POINTS", 0))
+BACKGROUND_CACHE_SIZE = 16
+COMPOUND_LOOKUP = "Compound to Bacteria"
+BACTERIUM_LOOKUP = "Bacterium to Compounds"
+COMPARE_LOOKUP = "Compare Compounds"
+SORT_BY_FEATURE = {"embedding score": "embedding", "proximity in graph space": "shortest_path_length", "proximity pvalue": "p_value"}
+COMPARE_RANK_BY = {"mean embedding score": "mean_embedding", "max embedding score": "max_embedding", "significant p-value count": "significant_count"}
+COLUMN_LABELS = {"ncbi_id": "NCBI ID", "embedding": "embedding score", "shortest_path_length": "proximity in graph space", "p_value": "proximity pvalue", "mean_embedding": "mean embedding score", "max_embedding": "max embedding score", "significant_count": "significant p-value count", "background_p_value": "custom background pvalue"}
 
 
-with open("data/bcmm_compounds_all_bacteria_with_proximity_pvalue.pickle", "rb") as f:
-    data = pickle.load(f)
-compound_names = list(data.keys())[:-2]
-compounds_to_remove = ['diacetamate',
- 'azetirelin',
- 'ipsalazide',
- 'indicine n-oxide',
- 'cyclohexylsulfamate',
- 'cortisol']
-compound_names = list(set(compound_names) - set(compounds_to_remove))
+store = get_bcmm_store()
+rank_index = get_rank_index("bcmm", lambda: build_bcmm_rank_index(store))
+compound_names = list(store.compound_names)
+compound_names = list(set(compound_names) - set(EXCLUDED_COMPOUNDS))
 compound_names.sort()
-MAX_COUNT = data[compound_names[0]]["embedding"].shape[0]
+compound_rows = [store.compound_index[compound_name] for compound_name in compound_names]
+compound_index = get_compound_index(BCMM_COMPOUNDS_PATH, compound_names)
+MAX_COUNT = store.n_bacteria
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+_background_cache = OrderedDict()
+_background_cache_lock = threading.Lock()
 
 
+@timed("app.main")
 def main():    
     st.markdown("<h1 style='text-align: center; color: black;'>BCMM Compounds - SPOKE insight</h1>", unsafe_allow_html=True)
+    lookup_mode = st.sidebar.radio("Lookup mode", [COMPOUND_LOOKUP, BACTERIUM_LOOKUP, COMPARE_LOOKUP])
+    if lookup_mode == BACTERIUM_LOOKUP:
+        bacterium_lookup()
+        return
+    if lookup_mode == COMPARE_LOOKUP:
+        compare_compounds()
+        return
     st.sidebar.header("Sample Compounds")
     hyperlink_names = ["dolasetron", "fludrocortisone acetate", "phenazopyridine", "trandolapril", "biperiden"]
     compound_selected_sample = st.sidebar.radio("", [None] + hyperlink_names)
     st.sidebar.header("Full Search - Select Compound")
-    compound_selected_search = get_search_term(compound_names)    
+    compound_selected_search = get_search_term(compound_index, DEFAULT_SELECTION)    
     bacteria_count, sort_by = sidebar_options()
     if compound_selected_search == DEFAULT_SELECTION and compound_selected_sample != None:
         write_bacteria_table(compound_selected_sample, bacteria_count, sort_by)
         plot_bacteria_table(compound_selected_sample)
+        write_background_p_values(compound_selected_sample, bacteria_count)
     if compound_selected_search != DEFAULT_SELECTION and compound_selected_sample != None:
         st.markdown("<h5 style='text-align: center; color: black;'>Multiple Compound selection was made.</h5>", unsafe_allow_html=True)
         st.markdown("<h5 style='text-align: center; color: black;'>Reset either Sample or Search Compound to None</h5>", unsafe_allow_html=True)
     if compound_selected_search != DEFAULT_SELECTION and compound_selected_sample == None:
         write_bacteria_table(compound_selected_search, bacteria_count, sort_by)
         plot_bacteria_table(compound_selected_search)
+        write_background_p_values(compound_selected_search, bacteria_count)
 
 
 
 def sidebar_options():
         bacteria_count = st.sidebar.slider('Bacteria count', MIN_COUNT, MAX_COUNT, DEFAULT_COUNT)
-        sort_by = st.sidebar.selectbox("How to sort", ["embedding score", "proximity in graph space", "proximity pvalue"], index=0)
+        sort_by = st.sidebar.selectbox("How to sort", list(SORT_BY_FEATURE), index=0)
         st.sidebar.markdown("<h4 style='text-align: left; color: black;'>Sorting features</h4>", unsafe_allow_html=True)
         st.sidebar.markdown("<h5 style='text-align: left; color: black;'>embedding score: It represents the relative saliency of a bacterial node to the selected compound (expressed as percentile score)</h5>", unsafe_allow_html=True)
         st.sidebar.markdown("<h5 style='text-align: left; color: black;'>proximity in graph space: It represents the number of hops (or edges) that the bacteria is away from the compound node in SPOKE graph</h5>", unsafe_allow_html=True)
         st.sidebar.markdown("<h5 style='text-align: left; color: black;'>proximity pvalue: Statistical significance of the above mentioned 'proximity in graph space'. ie. it represents how proximal the bacterial node is to the selected compound in SPOKE graph, compared to a random bacterial node</h5>", unsafe_allow_html=True)
         return bacteria_count, sort_by
     
+def bacterium_lookup():
+    st.sidebar.header("Select Bacterium")
+    organism_id = st.sidebar.text_input("Enter NCBI ID of the Organism").strip()
+    compound_count = st.sidebar.slider('Compound count', 1, len(compound_names), min(DEFAULT_COUNT, len(compound_names)))
+    sort_by = st.sidebar.selectbox("How to sort", list(SORT_BY_FEATURE), index=0)
+    if organism_id:
+        write_compound_table(organism_id, compound_count, sort_by)
+
+
+def write_compound_table(organism_id, compound_count, sort_by):
+    if organism_id not in store.bacterium_index:
+        st.markdown("<h5 style='text-align: center; color: black;'>NCBI ID {} is not in the dataset</h5>".format(organism_id), unsafe_allow_html=True)
+        return
+    organism_name = store.name[store.bacterium_index[organism_id]]
+    st.markdown("<h4 style='text-align: left; color: black;'>Top Compounds associated with {}</h4>".format(organism_name), unsafe_allow_html=True)
+    st.write(get_compound_table(organism_id, compound_count, sort_by))
+
+
+def compare_compounds():
+    st.sidebar.header("Select Compounds")
+    compounds_selected = st.sidebar.multiselect("Compounds to compare", compound_names)
+    bacteria_count = st.sidebar.slider('Bacteria count', MIN_COUNT, MAX_COUNT, DEFAULT_COUNT)
+    rank_by = st.sidebar.selectbox("How to rank", list(COMPARE_RANK_BY), index=0)
+    if compounds_selected:
+        st.markdown("<h4 style='text-align: left; color: black;'>Top Bacterial nodes across {} selected compounds</h4>".format(len(compounds_selected)), unsafe_allow_html=True)
+        st.write(get_comparison_table(compounds_selected, bacteria_count, rank_by))
+
+
 def write_bacteria_table(compound_selected, bacteria_count, sort_by):    
     st.markdown("<h4 style='text-align: left; color: black;'>Top Bacterial nodes associated with {}</h4>".format(compound_selected), unsafe_allow_html=True)
     st.write(get_bacteria_table(compound_selected, bacteria_count, sort_by))
 
 
+@timed("app.plot_bacteria_table")
 def plot_bacteria_table(compound_selected):
-    data_selected = data[compound_selected]
-    data_selected["ncbi_id"] = data["ncbi_id"]
-    data_selected["name"] = data["name"]
-    data_selected_plot = pd.DataFrame(data_selected)
-    data_selected_plot = data_selected_plot[["ncbi_id", "name", "embedding", "p_value"]]
-    data_selected_plot["color"] = "gray"
-    data_selected_plot.loc[data_selected_plot["p_value"] < 0.05, "color"] = "red"
-    data_selected_plot["size"] = MARKER_SIZE
-    color_discrete_map = {"gray": "gray", "red": "red"}
-
-    fig = px.scatter(data_selected_plot, 
-                     x="p_value", y="embedding", 
-                     color="color",
-                     color_discrete_map=color_discrete_map,
-                     opacity=FIG_OPACITY, 
-                     hover_name="name",
-                     hover_data=["name"]
-                    )
+    figure = get_bacteria_figure(compound_selected)
+    st.markdown("<h4 style='text-align: center; color: black;'>Distribution of entire bacteria in embedding and p-value space (associated with {})</h4>".format(compound_selected), unsafe_allow_html=True)
+    st.plotly_chart(figure)
+
+
+@timed("app.get_bacteria_figure")
+def get_bacteria_figure(compound_selected, max_background_points=PLOT_MAX_BACKGROUND_POINTS):
+    # The scatter depends only on the compound, so its figure is kept in a
+    # bounded LRU and slider changes never rebuild it. The built go.Figure is
+    # cached rather than its JSON: st.plotly_chart re-validates every dict
+    # through plotly's Figure constructor, but only copies and serializes a
+    # Figure, which is already validated. It copies, so sharing is safe.
+    key = (compound_selected, max_background_points)
+    with _figure_cache_lock:
+        if key in _figure_cache:
+            _figure_cache.move_to_end(key)
+            return _figure_cache[key]
+    figure = build_bacteria_figure(compound_selected, max_background_points)
+    with _figure_cache_lock:
+        _figure_cache[key] = figure
+        while len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return figure
+
+
+def build_bacteria_figure(compound_selected, max_background_points=PLOT_MAX_BACKGROUND_POINTS):
+    data_selected = store.compound(compound_selected)
+    embedding = data_selected["embedding"]
+    p_value = data_selected["p_value"]
+    significant = p_value < SIGNIFICANCE_LEVEL
+    points = np.arange(store.n_bacteria)
+    if max_background_points:
+        background = np.flatnonzero(~significant)
+        kept = background[thin_dense_points(p_value[background], embedding[background], max_background_points)]
+        points = np.sort(np.concatenate([np.flatnonzero(significant), kept]))
+
+    fig = go.Figure(go.Scattergl(
+        x=p_value[points],
+        y=embedding[points],
+        mode="markers",
+        customdata=store.name[points],
+        hovertemplate="<b>%{customdata}</b><br>p_value=%{x}<br>embedding=%{y}<extra></extra>",
+        opacity=FIG_OPACITY,
+        marker=dict(
+            size=MARKER_SIZE,
+            color=significant[points].astype(np.int8),
+            colorscale=[[0, NOT_SIGNIFICANT_COLOR], [1, SIGNIFICANT_COLOR]],
+            cmin=0,
+            cmax=1,
+        ),
+        showlegend=False,
+    ))
 
     fig.update_layout(
         margin=dict(l=20, r=20, t=20, b=20),
@@ -120,51 +213,119 @@ def plot_bacteria_table(compound_selected):
         )
     )
 
-    fig.update_traces(marker=dict(size=MARKER_SIZE))
-    fig.update_traces(showlegend=False)
-
-    fig.add_trace(go.Scatter(
+    fig.add_trace(go.Scattergl(
         x=[None],
         y=[None],
         mode="markers",
-        marker=dict(size=MARKER_SIZE, color="red"),
+        marker=dict(size=MARKER_SIZE, color=SIGNIFICANT_COLOR),
         name="Bacteria significantly proximal (p-value<0.05) to {} in SPOKE graph".format(compound_selected)
     ))
-    fig.add_trace(go.Scatter(
+    fig.add_trace(go.Scattergl(
         x=[None],
         y=[None],
         mode="markers",
-        marker=dict(size=MARKER_SIZE, color="gray"),
+        marker=dict(size=MARKER_SIZE, color=NOT_SIGNIFICANT_COLOR),
         name="Bacteria NOT significantly proximal to {} in SPOKE graph".format(compound_selected)
     ))
-    st.markdown("<h4 style='text-align: center; color: black;'>Distribution of entire bacteria in embedding and p-value space (associated with {})</h4>".format(compound_selected), unsafe_allow_html=True)
-    st.plotly_chart(fig)
+    return fig
+
+
+def write_background_p_values(compound_selected, bacteria_count):
+    with st.expander("Proximity p-values against a custom background"):
+        background_text = st.text_area("NCBI IDs of the background bacteria (comma or whitespace separated)")
+        rows, unknown = background_rows(store, parse_ncbi_ids(background_text))
+        if unknown:
+            st.markdown("<h5 style='text-align: left; color: black;'>Not in the dataset: {}</h5>".format(", ".join(unknown[:20])), unsafe_allow_html=True)
+        if rows.shape[0] == 0:
+            return
+        try:
+            background_df = get_background_table(compound_selected, rows, bacteria_count)
+        except ValueError:
+            st.markdown("<h5 style='text-align: left; color: black;'>None of the background bacteria has a path to {} in SPOKE</h5>".format(compound_selected), unsafe_allow_html=True)
+            return
+        st.markdown("<h5 style='text-align: left; color: black;'>Most proximal bacteria to {} compared to a random bacterial node of the {} background bacteria</h5>".format(compound_selected, rows.shape[0]), unsafe_allow_html=True)
+        st.write(background_df)
+
+
+@timed("app.get_background_table", on_result=record_size("table_rows", table="app.get_background_table"))
+def get_background_table(compound_selected, rows, bacteria_count):
+    p_values = get_background_p_values(compound_selected, rows)
+    order = top_k_positions(p_values, bacteria_count, ascending=True)
+    data_selected = store.compound(compound_selected)
+    background_df = pd.DataFrame({
+        "ncbi_id": store.ncbi_id[order].astype(str),
+        "name": store.name[order],
+        "shortest_path_length": data_selected["shortest_path_length"][order],
+        "p_value": data_selected["p_value"][order],
+        "background_p_value": p_values[order],
+    })
+    background_df.rename(columns=COLUMN_LABELS, inplace=True)
+    return background_df
+
+
+def get_background_p_values(compound_selected, rows):
+    # Same LRU pattern as the figure cache: reruns with an unchanged
+    # background reuse the result.
+    key = (compound_selected, rows.tobytes())
+    with _background_cache_lock:
+        if key in _background_cache:
+            _background_cache.move_to_end(key)
+            return _background_cache[key]
+    p_values = background_p_values(store, compound_selected, rows)
+    with _background_cache_lock:
+        _background_cache[key] = p_values
+        while len(_background_cache) > BACKGROUND_CACHE_SIZE:
+            _background_cache.popitem(last=False)
+    return p_values
+
+
+def thin_dense_points(x, y, max_points):
+    # Caps the number of points per cell of a grid with at most max_points
+    # cells, with the cap chosen so at most max_points survive: sparse
+    # regions are kept whole and only crowded cells are thinned. Returns the
+    # kept positions.
+    if x.shape[0] <= max_points:
+        return np.arange(x.shape[0])
+    bins = max(int(np.sqrt(max_points)), 1)
+    cell = _grid_cell(x, bins) * bins + _grid_cell(y, bins)
+    order = np.argsort(cell, kind="stable")
+    counts = np.bincount(cell, minlength=bins * bins)
+    occupied = np.sort(counts[counts > 0])
+    # kept(cap) = sum(min(counts, cap)) grows with cap; take the largest cap that fits.
+    kept = np.cumsum(occupied) + occupied * (occupied.shape[0] - 1 - np.arange(occupied.shape[0]))
+    cap = occupied[np.searchsorted(kept, max_points, side="right") - 1] if kept[0] <= max_points else 1
+    sorted_cell = cell[order]
+    rank_in_cell = np.arange(order.shape[0]) - np.searchsorted(sorted_cell, sorted_cell)
+    return np.sort(order[rank_in_cell < cap])
+
+
+def _grid_cell(values, bins):
+    low, high = np.nanmin(values), np.nanmax(values)
+    scaled = (values - low) / (high - low) if high > low else np.zeros_like(values)
+    return np.clip(np.nan_to_num(scaled * bins).astype(np.int64), 0, bins - 1)
     
     
     
                  
+@timed("app.get_bacteria_table", on_result=record_size("table_rows", table="app.get_bacteria_table"))
 def get_bacteria_table(compound_selected, bacteria_count, sort_by):
-    data_selected = data[compound_selected]
-    data_selected["ncbi_id"] = data["ncbi_id"]
-    data_selected["name"] = data["name"]
-    data_selected_df = pd.DataFrame(data_selected)
-    data_selected_df = data_selected_df[["ncbi_id", "name", "embedding", "shortest_path_length", "p_value"]]
-    if sort_by == "embedding score":
-        bacteria_df = data_selected_df.sort_values(by="embedding", ascending=False).head(bacteria_count)
-    elif sort_by == "proximity pvalue":
-        bacteria_df = data_selected_df.sort_values(by="p_value", ascending=True).head(bacteria_count)
-    else:
-        bacteria_df = data_selected_df.sort_values(by="shortest_path_length", ascending=True).head(bacteria_count)
-        
+    bacteria_df = ranked_bacteria_table(store, rank_index, compound_selected, SORT_BY_FEATURE[sort_by], bacteria_count)
     bacteria_df.ncbi_id = bacteria_df.ncbi_id.astype(str)    
-    bacteria_df.rename(columns={"ncbi_id": "NCBI ID", "embedding": "embedding score", "shortest_path_length": "proximity in graph space", "p_value": "proximity pvalue"}, inplace=True)                
-    return bacteria_df.reset_index().drop("index", axis=1)
-    
+    bacteria_df.rename(columns=COLUMN_LABELS, inplace=True)                
+    return bacteria_df
+
 
-def get_search_term(compound_names):
-    return st.sidebar.selectbox(" ", [DEFAULT_SELECTION]+compound_names, index=0)
-        
+def get_compound_table(organism_id, compound_count, sort_by):
+    compound_df = ranked_compound_table(store, organism_id, SORT_BY_FEATURE[sort_by], compound_count, compound_rows=compound_rows)
+    compound_df.rename(columns=COLUMN_LABELS, inplace=True)
+    return compound_df
+    
 
+def get_comparison_table(compounds_selected, bacteria_count, rank_by):
+    comparison_df = compare_compounds_table(store, compounds_selected, bacteria_count, COMPARE_RANK_BY[rank_by])
+    comparison_df.ncbi_id = comparison_df.ncbi_id.astype(str)
+    comparison_df.rename(columns=COLUMN_LABELS, inplace=True)
+    return comparison_df
 
 
 if __name__ == "__main__":
@@ -1,7 +1,10 @@
 from netvis import *
 import pandas as pd
-import numpy as np
-import pickle
+from compound_index import DWPC_COMPOUNDS_PATH, get_compound_index, get_search_term
+from data_store import get_dwpc_store
+from metrics import record_size, timed
+from prefetch import PREFETCH_TOP_N, session_prefetcher
+from ranking import build_dwpc_rank_index, get_rank_index, ranked_dwpc_table, top_k_positions
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -15,36 +18,49 @@ FIG_WIDTH = 500
 FIG_HEIGHT = 700
 FONT_SIZE = 18
 LEGEND_SIZE = 12
+COMPOUND_LOOKUP = "Compound to Bacteria"
+BACTERIUM_LOOKUP = "Bacterium to Compounds"
+COMPARE_LOOKUP = "Compare Compounds"
 
 
 
 
-cmp_df_selected_with_index = pd.read_csv('data/cmp_df_selected_with_index.csv')
-org_df_selected_with_index = pd.read_csv('data/org_df_selected_with_index.csv')
-org_cmp_selected_metapath = pd.read_csv('data/org_cmp_manually_selected_metapath.csv')
-dwpc_mat_2d = np.load('data/dwpc_mat_2d.npy')
+compound_index = get_compound_index(DWPC_COMPOUNDS_PATH)
+org_cmp_selected_metapath_queries = load_metapath_queries('data/org_cmp_manually_selected_metapath.csv')
+dwpc_store = get_dwpc_store()
+dwpc_rank_index = get_rank_index("dwpc", lambda: build_dwpc_rank_index(dwpc_store))
 
-compound_names = list(cmp_df_selected_with_index.compound_name.unique())
-compound_names.sort()
+compound_names = list(compound_index.compound_names)
+compound_names_by_index = pd.Series(compound_index.columns).sort_values().index.values
 
-MAX_COUNT = org_df_selected_with_index.shape[0]
+MAX_COUNT = dwpc_store.n_bacteria
 
 
+@timed("app_metapath_based.main")
 def main():    
     st.markdown("<h1 style='text-align: center; color: black;'>BCMM Compounds - SPOKE insight</h1>", unsafe_allow_html=True)
+    lookup_mode = st.sidebar.radio("Lookup mode", [COMPOUND_LOOKUP, BACTERIUM_LOOKUP, COMPARE_LOOKUP])
+    if lookup_mode == BACTERIUM_LOOKUP:
+        bacterium_lookup()
+        return
+    if lookup_mode == COMPARE_LOOKUP:
+        compare_compounds()
+        return
     st.sidebar.header("Sample Compounds")
     hyperlink_names = ["Cholic acid", "ursodiol", "estrone 3-sulfate", "doxorubicin", "lithocholic acid"]
     compound_selected_sample = st.sidebar.radio("", [None] + hyperlink_names)
     st.sidebar.header("Full Search - Select Compound")
-    compound_selected_search = get_search_term(compound_names)
+    compound_selected_search = get_search_term(compound_index, DEFAULT_SELECTION)
     bacteria_count = sidebar_options()
+    prefetch_enabled = st.sidebar.checkbox("Prefetch networks of the top {} bacteria".format(PREFETCH_TOP_N))
     if compound_selected_search == DEFAULT_SELECTION and compound_selected_sample != None:
         write_bacteria_table(compound_selected_sample, bacteria_count)
         st.markdown("<h4 style='text-align: left; color: black;'>Explore SPOKE network for {}</h4>".format(compound_selected_sample), unsafe_allow_html=True)
         print_vpn_warning()
         organism_id = st.text_input("Enter NCBI ID of the Organism")
-        compound_id = cmp_df_selected_with_index[cmp_df_selected_with_index.compound_name==compound_selected_sample].spoke_identifier.values[0]
-        metapath_based_network_vis(organism_id, compound_id, org_cmp_selected_metapath)
+        compound_id = compound_index.identifier(compound_selected_sample)
+        prefetch_network_views(compound_selected_sample, compound_id, prefetch_enabled)
+        metapath_based_network_vis(organism_id, compound_id, org_cmp_selected_metapath_queries)
         
         
     if compound_selected_search != DEFAULT_SELECTION and compound_selected_sample != None:
@@ -55,35 +71,86 @@ def main():
         st.markdown("<h4 style='text-align: left; color: black;'>Explore SPOKE network for {}</h4>".format(compound_selected_search), unsafe_allow_html=True)
         print_vpn_warning()
         organism_id = st.text_input("Enter NCBI ID of the Organism")
-        compound_id = cmp_df_selected_with_index[cmp_df_selected_with_index.compound_name==compound_selected_search].spoke_identifier.values[0]
-        metapath_based_network_vis(organism_id, compound_id, org_cmp_selected_metapath)
-        
-        
-    
-    
+        compound_id = compound_index.identifier(compound_selected_search)
+        prefetch_network_views(compound_selected_search, compound_id, prefetch_enabled)
+        metapath_based_network_vis(organism_id, compound_id, org_cmp_selected_metapath_queries)
+    if (compound_selected_search == DEFAULT_SELECTION) == (compound_selected_sample == None):
+        session_prefetcher().cancel()
+
+
+def prefetch_network_views(compound_selected, compound_id, enabled):
+    # Warms the network views of the top rows of the bacteria table on the
+    # background pool (see prefetch.py); a new compound cancels the last one's.
+    if not enabled or compound_id is None:
+        session_prefetcher().cancel()
+        return
+    ncbi_ids = get_bacteria_table(compound_selected, PREFETCH_TOP_N)["NCBI ID"]
+    session_prefetcher().prefetch(("metapath", compound_id), [(prefetch_metapath_view, (ncbi_id, compound_id, org_cmp_selected_metapath_queries)) for ncbi_id in ncbi_ids])
+
+
 def sidebar_options():
     bacteria_count = st.sidebar.slider('Bacteria count', MIN_COUNT, MAX_COUNT, DEFAULT_COUNT)
     return bacteria_count
     
 
+def bacterium_lookup():
+    st.sidebar.header("Select Bacterium")
+    organism_id = st.sidebar.text_input("Enter NCBI ID of the Organism").strip()
+    compound_count = st.sidebar.slider('Compound count', 1, len(compound_names_by_index), min(DEFAULT_COUNT, len(compound_names_by_index)))
+    if organism_id:
+        write_compound_table(organism_id, compound_count)
+
+
+def write_compound_table(organism_id, compound_count):
+    if organism_id not in dwpc_store.bacterium_index:
+        st.markdown("<h5 style='text-align: center; color: black;'>NCBI ID {} is not in the dataset</h5>".format(organism_id), unsafe_allow_html=True)
+        return
+    organism_name = dwpc_store.spoke_name[dwpc_store.bacterium_index[organism_id]]
+    st.markdown("<h4 style='text-align: left; color: black;'>Top Compounds associated with {}</h4>".format(organism_name), unsafe_allow_html=True)
+    st.write(get_compound_table(organism_id, compound_count))
+
+
+def compare_compounds():
+    st.sidebar.header("Select Compounds")
+    compounds_selected = st.sidebar.multiselect("Compounds to compare", compound_names)
+    bacteria_count = st.sidebar.slider('Bacteria count', MIN_COUNT, MAX_COUNT, DEFAULT_COUNT)
+    if compounds_selected:
+        st.markdown("<h4 style='text-align: left; color: black;'>Top Bacterial nodes across {} selected compounds</h4>".format(len(compounds_selected)), unsafe_allow_html=True)
+        st.write(get_comparison_table(compounds_selected, bacteria_count))
+
+
 def write_bacteria_table(compound_selected, bacteria_count):    
     st.markdown("<h4 style='text-align: left; color: black;'>Top Bacterial nodes associated with {}</h4>".format(compound_selected), unsafe_allow_html=True)
     st.write(get_bacteria_table(compound_selected, bacteria_count))
     
     
+@timed("app_metapath_based.get_bacteria_table", on_result=record_size("table_rows", table="app_metapath_based.get_bacteria_table"))
 def get_bacteria_table(cmp_name, bacteria_count):
-    column_ind = cmp_df_selected_with_index[cmp_df_selected_with_index.compound_name==cmp_name].cmp_index.values[0]
-    cmp_df_selected_with_index_copy = org_df_selected_with_index.copy()
-    cmp_df_selected_with_index_copy.loc[:,'dwpc'] = dwpc_mat_2d[:,column_ind]
-    cmp_df_selected_with_index_copy = cmp_df_selected_with_index_copy[['spoke_id', 'spoke_name', 'dwpc']]
-    cmp_df_selected_with_index_copy.spoke_id = cmp_df_selected_with_index_copy.spoke_id.astype(str)   
-    cmp_df_selected_with_index_copy = cmp_df_selected_with_index_copy.rename(columns={'spoke_id':'NCBI ID', 'spoke_name':'name'})
-    cmp_df_selected_with_index_copy = cmp_df_selected_with_index_copy.sort_values(by='dwpc', ascending=False).head(bacteria_count)
-    return cmp_df_selected_with_index_copy.reset_index().drop("index", axis=1)
+    column_ind = compound_index.column(cmp_name)
+    bacteria_df = ranked_dwpc_table(dwpc_store, dwpc_rank_index, column_ind, bacteria_count)
+    bacteria_df.spoke_id = bacteria_df.spoke_id.astype(str)
+    bacteria_df.rename(columns={'spoke_id': 'NCBI ID', 'spoke_name': 'name'}, inplace=True)
+    return bacteria_df
+    
+    
+def get_compound_table(organism_id, compound_count):
+    dwpc_row = dwpc_store.row(organism_id)
+    order = top_k_positions(dwpc_row, compound_count, ascending=False)
+    return pd.DataFrame({
+        'compound': compound_names_by_index[order],
+        'dwpc': dwpc_row[order],
+    })
     
     
-def get_search_term(compound_names):
-    return st.sidebar.selectbox(" ", [DEFAULT_SELECTION]+compound_names, index=0)
+def get_comparison_table(compounds_selected, bacteria_count):
+    column_inds = [compound_index.column(cmp_name) for cmp_name in compounds_selected]
+    summed_dwpc = dwpc_store.by_compound[column_inds].sum(axis=0)
+    order = top_k_positions(summed_dwpc, bacteria_count, ascending=False)
+    return pd.DataFrame({
+        'NCBI ID': dwpc_store.spoke_id[order].astype(str),
+        'name': dwpc_store.spoke_name[order],
+        'summed dwpc': summed_dwpc[order],
+    })
 
 
 if __name__ == "__main__":
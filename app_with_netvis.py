@@ -1,6 +1,9 @@
 from netvis import *
-import pandas as pd
-import pickle
+from compound_index import BCMM_COMPOUNDS_PATH, get_compound_index, get_search_term
+from data_store import EXCLUDED_COMPOUNDS, get_bcmm_store
+from metrics import record_size, timed
+from prefetch import PREFETCH_TOP_N, session_prefetcher
+from ranking import build_bcmm_rank_index, get_rank_index, ranked_bacteria_table, ranked_compound_table, compare_compounds_table
 import plotly.express as px
 import plotly.graph_objects as go
 
@@ -14,38 +17,46 @@ FIG_WIDTH = 500
 FIG_HEIGHT = 700
 FONT_SIZE = 18
 LEGEND_SIZE = 12
+COMPOUND_LOOKUP = "Compound to Bacteria"
+BACTERIUM_LOOKUP = "Bacterium to Compounds"
+COMPARE_LOOKUP = "Compare Compounds"
+COMPARE_RANK_BY = {"mean embedding score": "mean_embedding", "max embedding score": "max_embedding"}
 
 
-with open("data/bcmm_compounds_all_bacteria_with_proximity_pvalue.pickle", "rb") as f:
-    data = pickle.load(f)
-compound_names = list(data.keys())[:-2]
-compounds_to_remove = ['diacetamate',
- 'azetirelin',
- 'ipsalazide',
- 'indicine n-oxide',
- 'cyclohexylsulfamate',
- 'cortisol']
-compound_names = list(set(compound_names) - set(compounds_to_remove))
+store = get_bcmm_store()
+rank_index = get_rank_index("bcmm", lambda: build_bcmm_rank_index(store))
+compound_names = list(store.compound_names)
+compound_names = list(set(compound_names) - set(EXCLUDED_COMPOUNDS))
 compound_names.sort()
-MAX_COUNT = data[compound_names[0]]["embedding"].shape[0]
-
-cmp_map = pd.read_csv("data/bcmm_compounds_combined_refined.csv")
+compound_rows = [store.compound_index[compound_name] for compound_name in compound_names]
+compound_index = get_compound_index(BCMM_COMPOUNDS_PATH, compound_names)
+MAX_COUNT = store.n_bacteria
 
 
+@timed("app_with_netvis.main")
 def main():    
     st.markdown("<h1 style='text-align: center; color: black;'>BCMM Compounds - SPOKE insight</h1>", unsafe_allow_html=True)
+    lookup_mode = st.sidebar.radio("Lookup mode", [COMPOUND_LOOKUP, BACTERIUM_LOOKUP, COMPARE_LOOKUP])
+    if lookup_mode == BACTERIUM_LOOKUP:
+        bacterium_lookup()
+        return
+    if lookup_mode == COMPARE_LOOKUP:
+        compare_compounds()
+        return
     st.sidebar.header("Sample Compounds")
     hyperlink_names = ["dolasetron", "fludrocortisone acetate", "phenazopyridine", "trandolapril", "biperiden"]
     compound_selected_sample = st.sidebar.radio("", [None] + hyperlink_names)
     st.sidebar.header("Full Search - Select Compound")
-    compound_selected_search = get_search_term(compound_names)    
+    compound_selected_search = get_search_term(compound_index, DEFAULT_SELECTION)    
     bacteria_count = sidebar_options()
+    prefetch_enabled = st.sidebar.checkbox("Prefetch networks of the top {} bacteria".format(PREFETCH_TOP_N))
     if compound_selected_search == DEFAULT_SELECTION and compound_selected_sample != None:
         write_bacteria_table(compound_selected_sample, bacteria_count)
         st.markdown("<h4 style='text-align: left; color: black;'>Explore SPOKE network for {}</h4>".format(compound_selected_sample), unsafe_allow_html=True)
         print_vpn_warning()
         organism_id = st.text_input("Enter NCBI ID of the Organism")
-        compound_id = cmp_map[cmp_map.compound_name==compound_selected_sample].spoke_identifier.values[0]
+        compound_id = compound_index.identifier(compound_selected_sample)
+        prefetch_network_views(compound_selected_sample, compound_id, prefetch_enabled)
         network_vis(organism_id, compound_id)
 
     if compound_selected_search != DEFAULT_SELECTION and compound_selected_sample != None:
@@ -56,9 +67,21 @@ def main():
         st.markdown("<h4 style='text-align: left; color: black;'>Explore SPOKE network for {}</h4>".format(compound_selected_search), unsafe_allow_html=True)
         print_vpn_warning()
         organism_id = st.text_input("Enter NCBI ID of the Organism")
-        compound_id = cmp_map[cmp_map.compound_name==compound_selected_search].spoke_identifier.values[0]
+        compound_id = compound_index.identifier(compound_selected_search)
+        prefetch_network_views(compound_selected_search, compound_id, prefetch_enabled)
         network_vis(organism_id, compound_id)
+    if (compound_selected_search == DEFAULT_SELECTION) == (compound_selected_sample == None):
+        session_prefetcher().cancel()
+
 
+def prefetch_network_views(compound_selected, compound_id, enabled):
+    # Warms the network views of the top rows of the bacteria table on the
+    # background pool (see prefetch.py); a new compound cancels the last one's.
+    if not enabled or compound_id is None:
+        session_prefetcher().cancel()
+        return
+    ncbi_ids = get_bacteria_table(compound_selected, PREFETCH_TOP_N)["NCBI ID"]
+    session_prefetcher().prefetch(("path", compound_id), [(path_view, (ncbi_id, compound_id)) for ncbi_id in ncbi_ids])
 
 
 def sidebar_options():
@@ -67,6 +90,33 @@ def sidebar_options():
         st.sidebar.markdown("<h5 style='text-align: left; color: black;'>It is the value obtained from applying personalized page rank algorithm on SPOKE graph. It represents the relative saliency of a bacterial node to the selected compound (expressed as percentile score)</h5>", unsafe_allow_html=True)
         return bacteria_count
     
+def bacterium_lookup():
+    st.sidebar.header("Select Bacterium")
+    organism_id = st.sidebar.text_input("Enter NCBI ID of the Organism").strip()
+    compound_count = st.sidebar.slider('Compound count', 1, len(compound_names), min(DEFAULT_COUNT, len(compound_names)))
+    if organism_id:
+        write_compound_table(organism_id, compound_count)
+
+
+def write_compound_table(organism_id, compound_count):
+    if organism_id not in store.bacterium_index:
+        st.markdown("<h5 style='text-align: center; color: black;'>NCBI ID {} is not in the dataset</h5>".format(organism_id), unsafe_allow_html=True)
+        return
+    organism_name = store.name[store.bacterium_index[organism_id]]
+    st.markdown("<h4 style='text-align: left; color: black;'>Top Compounds associated with {}</h4>".format(organism_name), unsafe_allow_html=True)
+    st.write(get_compound_table(organism_id, compound_count))
+
+
+def compare_compounds():
+    st.sidebar.header("Select Compounds")
+    compounds_selected = st.sidebar.multiselect("Compounds to compare", compound_names)
+    bacteria_count = st.sidebar.slider('Bacteria count', MIN_COUNT, MAX_COUNT, DEFAULT_COUNT)
+    rank_by = st.sidebar.selectbox("How to rank", list(COMPARE_RANK_BY), index=0)
+    if compounds_selected:
+        st.markdown("<h4 style='text-align: left; color: black;'>Top Bacterial nodes across {} selected compounds</h4>".format(len(compounds_selected)), unsafe_allow_html=True)
+        st.write(get_comparison_table(compounds_selected, bacteria_count, rank_by))
+
+
 def write_bacteria_table(compound_selected, bacteria_count):    
     st.markdown("<h4 style='text-align: left; color: black;'>Top Bacterial nodes associated with {}</h4>".format(compound_selected), unsafe_allow_html=True)
     st.write(get_bacteria_table(compound_selected, bacteria_count))
@@ -75,22 +125,25 @@ def write_bacteria_table(compound_selected, bacteria_count):
     
     
                  
+@timed("app_with_netvis.get_bacteria_table", on_result=record_size("table_rows", table="app_with_netvis.get_bacteria_table"))
 def get_bacteria_table(compound_selected, bacteria_count):
-    data_selected = data[compound_selected]
-    data_selected["ncbi_id"] = data["ncbi_id"]
-    data_selected["name"] = data["name"]
-    data_selected_df = pd.DataFrame(data_selected)
-    data_selected_df = data_selected_df[["ncbi_id", "name", "embedding"]]
-    bacteria_df = data_selected_df.sort_values(by="embedding", ascending=False).head(bacteria_count)        
+    bacteria_df = ranked_bacteria_table(store, rank_index, compound_selected, "embedding", bacteria_count, features=["embedding"])
     bacteria_df.ncbi_id = bacteria_df.ncbi_id.astype(str)    
     bacteria_df.rename(columns={"ncbi_id": "NCBI ID", "embedding": "embedding score"}, inplace=True)                
-    return bacteria_df.reset_index().drop("index", axis=1)
-    
+    return bacteria_df
 
-def get_search_term(compound_names):
-    return st.sidebar.selectbox(" ", [DEFAULT_SELECTION]+compound_names, index=0)
-        
 
+def get_compound_table(organism_id, compound_count):
+    compound_df = ranked_compound_table(store, organism_id, "embedding", compound_count, compound_rows=compound_rows, features=["embedding"])
+    compound_df.rename(columns={"embedding": "embedding score"}, inplace=True)
+    return compound_df
+    
+
+def get_comparison_table(compounds_selected, bacteria_count, rank_by):
+    comparison_df = compare_compounds_table(store, compounds_selected, bacteria_count, COMPARE_RANK_BY[rank_by], aggregates=list(COMPARE_RANK_BY.values()))
+    comparison_df.ncbi_id = comparison_df.ncbi_id.astype(str)
+    comparison_df.rename(columns={"ncbi_id": "NCBI ID", "mean_embedding": "mean embedding score", "max_embedding": "max embedding score"}, inplace=True)
+    return comparison_df
 
 
 if __name__ == "__main__":
@@ -0,0 +1,370 @@
+# Concurrent-session load test for the Streamlit apps.
+#
+#   python -m benchmarks.loadtest [--apps app app_with_netvis app_metapath_based]
+#       [--sessions 1 2 4 8] [--iterations 3] [--latency 0.05] [--fan-out 4] [--output load.json]
+#
+# Run from the repository root. For every app and session count, a fresh
+# `streamlit run` server subprocess serves the app, and that many clients
+# connect to it at once over Streamlit's websocket, each going through the
+# app's interaction script (select a compound, move the slider, change the
+# sort, enter an organism ID); every widget change is one timed rerun, from
+# sending the new widget states to the server's script_finished message.
+# Stores are synthetic and SPOKE is a StandInSpokeGraph with the given
+# per-query latency and fan-out, both set up inside the server process.
+#
+# All sessions of a level share one server process, as in production: one
+# interpreter lock, the pooled driver, the metapath and prefetch pools and
+# the path cache. Throughput and rerun latency per session count therefore
+# show how many simultaneous users one server handles before reruns queue.
+# The clients run on one event loop in this process and only parse the
+# server's messages, so they take little CPU away from the server.
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import collections
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from datetime import datetime, timezone
+import numpy as np
+from benchmarks.run import REPO_ROOT, _environment
+
+
+APPS = ["app", "app_with_netvis", "app_metapath_based"]
+DEFAULT_SESSIONS = [1, 2, 4, 8]
+DEFAULT_ITERATIONS = 3
+DEFAULT_LATENCY = 0.05
+DEFAULT_FAN_OUT = 4
+RERUN_TIMEOUT = 300
+SERVER_START_TIMEOUT = 120
+ORGANISM_LABEL = "Enter NCBI ID of the Organism"
+LOOKUP_MODE_LABEL = "Lookup mode"
+COMPOUND_LOOKUP = "Compound to Bacteria"
+BACTERIUM_LOOKUP = "Bacterium to Compounds"
+
+
+def widget(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError("No widget labelled {!r}".format(label))
+
+
+# Steps change one widget of the element tree parsed from the last rerun and
+# return it.
+def select_compound(tree, rng, organism_ids):
+    # The sample-compound radio is the unlabelled one in the sidebar.
+    sample = widget(tree.sidebar.radio, "")
+    return sample.set_value(sample.options[rng.integers(1, len(sample.options))])
+
+
+def move_slider(tree, rng, organism_ids):
+    slider = widget(tree.sidebar.slider, "Bacteria count")
+    return slider.set_value(int(rng.integers(slider.min, min(slider.max, 4 * slider.min) + 1)))
+
+
+def change_sort(tree, rng, organism_ids):
+    sort_by = widget(tree.sidebar.selectbox, "How to sort")
+    return sort_by.set_value(sort_by.options[rng.integers(len(sort_by.options))])
+
+
+def bacterium_lookup(tree, rng, organism_ids):
+    return widget(tree.sidebar.radio, LOOKUP_MODE_LABEL).set_value(BACTERIUM_LOOKUP)
+
+
+def compound_lookup(tree, rng, organism_ids):
+    return widget(tree.sidebar.radio, LOOKUP_MODE_LABEL).set_value(COMPOUND_LOOKUP)
+
+
+def enter_organism_id(tree, rng, organism_ids):
+    return widget(tree.text_input, ORGANISM_LABEL).input(str(organism_ids[rng.integers(len(organism_ids))]))
+
+
+STEPS = {
+    "select compound": select_compound,
+    "move slider": move_slider,
+    "change sort": change_sort,
+    "bacterium lookup": bacterium_lookup,
+    "compound lookup": compound_lookup,
+    "enter organism ID": enter_organism_id,
+}
+# app.py has no network view; its organism ID box is the bacterium lookup.
+APP_SCRIPTS = {
+    "app": ["select compound", "move slider", "change sort", "bacterium lookup", "enter organism ID", "compound lookup"],
+    "app_with_netvis": ["select compound", "move slider", "enter organism ID"],
+    "app_metapath_based": ["select compound", "move slider", "enter organism ID"],
+}
+
+
+class DefaultFormatRunner:
+    # Stands in for the AppTest runner a parsed element tree expects: newer
+    # Streamlit versions look a radio's or selectbox's format_func up in its
+    # session state (under a testing key) to serialize a changed value. The
+    # apps keep the default, str, whatever the key.
+    def __init__(self):
+        self._session_state = collections.defaultdict(lambda: collections.defaultdict(lambda: str))
+
+
+class SessionClient:
+    # One browser session. Like the frontend, it sends the state of every
+    # widget it has changed with each rerun; widgets it never touched keep
+    # their defaults on the server.
+    def __init__(self, port):
+        self.url = "ws://127.0.0.1:{}/_stcore/stream".format(port)
+        self.connection = None
+        self.widget_states = {}
+
+    async def connect(self):
+        import tornado.websocket
+
+        self.connection = await tornado.websocket.websocket_connect(self.url, max_message_size=1 << 30)
+
+    async def rerun(self, changed=None):
+        # Returns the element tree of the finished run.
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.testing.v1.element_tree import parse_tree_from_messages
+
+        if changed is not None:
+            self.widget_states[changed.id] = changed._widget_state
+        back_msg = BackMsg()
+        back_msg.rerun_script.query_string = ""
+        back_msg.rerun_script.widget_states.widgets.extend(self.widget_states.values())
+        await self.connection.write_message(back_msg.SerializeToString(), binary=True)
+        # Deltas by delta path: a later delta to the same path (a placeholder
+        # the app refills as results arrive) replaces the earlier one, as in
+        # the browser.
+        deltas = {}
+        while True:
+            data = await self.connection.read_message()
+            if data is None:
+                raise ConnectionError("The server closed the session")
+            message = ForwardMsg()
+            message.ParseFromString(data)
+            if message.HasField("delta"):
+                deltas[tuple(message.metadata.delta_path)] = message
+            elif message.WhichOneof("type") == "script_finished":
+                tree = parse_tree_from_messages(list(deltas.values()))
+                tree._runner = DefaultFormatRunner()
+                return tree
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+async def run_session(client, app, iterations, seed, organism_ids):
+    # client: a connected SessionClient, closed when the session ends.
+    rng = np.random.default_rng(seed)
+    timings = []
+    errors = 0
+    steps = ["load"] + APP_SCRIPTS[app] * iterations
+    try:
+        tree = None
+        for step in steps:
+            changed = STEPS[step](tree, rng, organism_ids) if step != "load" else None
+            start = time.perf_counter()
+            try:
+                tree = await asyncio.wait_for(client.rerun(changed), RERUN_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError):
+                # A rerun past RERUN_TIMEOUT leaves the session unusable.
+                errors += len(steps) - len(timings)
+                break
+            timings.append((step, time.perf_counter() - start))
+            errors += len(tree.exception) > 0
+    except Exception:
+        errors += len(steps) - len(timings)
+    finally:
+        client.close()
+    return timings, errors
+
+
+async def run_sessions(port, app, n_sessions, iterations, organism_ids):
+    # Returns the wall time from the common start to the last session's end
+    # and (timings, errors) per session. All sessions connect before the
+    # clock starts, so the websocket handshakes are not timed.
+    clients = [SessionClient(port) for _ in range(n_sessions)]
+    await asyncio.gather(*(client.connect() for client in clients))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        run_session(client, app, iterations, i, organism_ids)
+        for i, client in enumerate(clients)
+    ))
+    return time.perf_counter() - start, results
+
+
+async def load_page(port, app, organism_ids):
+    client = SessionClient(port)
+    await client.connect()
+    return await run_session(client, app, 0, 0, organism_ids)
+
+
+def summarize(values):
+    values = np.asarray(values)
+    if values.shape[0] == 0:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "mean": values.mean(), "max": values.max()}
+
+
+def run_level(port, server_pid, app, n_sessions, iterations, latency, fan_out, scale):
+    from benchmarks.synthetic import synthetic_bcmm_store
+
+    # Same seed as the server's store, so the organism IDs are known to it.
+    organism_ids = synthetic_bcmm_store(scale).ncbi_id
+    # An untimed first page load, so imports, stores and rank indexes are
+    # built once before the sessions start, as on a server that is up.
+    start = time.perf_counter()
+    asyncio.run(load_page(port, app, organism_ids))
+    cold_start_s = time.perf_counter() - start
+    server_rss = _process_memory(server_pid).get("VmRSS")
+    wall_s, sessions = asyncio.run(run_sessions(port, app, n_sessions, iterations, organism_ids))
+    timings = [timing for session_timings, errors in sessions for timing in session_timings]
+    by_step = {}
+    for step, elapsed in timings:
+        by_step.setdefault(step, []).append(elapsed)
+    return {
+        "app": app,
+        "sessions": n_sessions,
+        "iterations": iterations,
+        "latency_s": latency,
+        "fan_out": fan_out,
+        "scale": scale,
+        "cold_start_s": cold_start_s,
+        "wall_time_s": wall_s,
+        "reruns": len(timings),
+        "errors": sum(errors for session_timings, errors in sessions),
+        "throughput_reruns_per_s": len(timings) / wall_s if wall_s else None,
+        "rerun_latency_s": summarize([elapsed for step, elapsed in timings]),
+        "rerun_latency_by_step_s": {step: summarize(values) for step, values in by_step.items()},
+        "server_rss_before_sessions_bytes": server_rss,
+        "server_max_rss_bytes": _process_memory(server_pid).get("VmHWM"),
+    }
+
+
+def run_server(args):
+    # The server process: synthetic stores and the stand-in SPOKE are set
+    # before `streamlit run` executes the app, which then finds them in
+    # data_store and netvis like the real ones.
+    os.chdir(REPO_ROOT)
+    import netvis
+    from data_store import set_bcmm_store, set_dwpc_store
+    from benchmarks.synthetic import stand_in_spoke, synthetic_bcmm_store, synthetic_dwpc_store
+    from streamlit.web import cli
+
+    set_bcmm_store(synthetic_bcmm_store(args.scale))
+    set_dwpc_store(synthetic_dwpc_store(args.scale))
+    netvis.set_driver(stand_in_spoke(args.fan_out, args.latency))
+    cli.main([
+        "run", os.path.join(REPO_ROOT, args.apps[0] + ".py"),
+        "--server.address", "127.0.0.1",
+        "--server.port", str(args.port),
+        "--server.headless", "true",
+        "--server.fileWatcherType", "none",
+        "--server.runOnSave", "false",
+        "--browser.gatherUsageStats", "false",
+        "--logger.level", "error",
+    ], prog_name="streamlit")
+
+
+def run_with_server(args, app, n_sessions):
+    port = _free_port()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        command = [
+            sys.executable, "-m", "benchmarks.loadtest",
+            "--serve",
+            "--port", str(port),
+            "--apps", app,
+            "--latency", str(args.latency),
+            "--fan-out", str(args.fan_out),
+            "--scale", str(args.scale),
+        ]
+        # A path cache of its own, so every level starts cold and the
+        # repository's cache is left alone.
+        env = dict(os.environ, SPOKE_PATH_CACHE_PATH=os.path.join(tmp_dir, "spoke_paths.sqlite"))
+        with open(os.path.join(tmp_dir, "server.log"), "w+") as log:
+            server = subprocess.Popen(command, cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+            try:
+                if not _wait_for_server(server, port):
+                    log.seek(0)
+                    return {"app": app, "sessions": n_sessions, "error": "server did not start", "log": log.read()[-4000:]}
+                return run_level(port, server.pid, app, n_sessions, args.iterations, args.latency, args.fan_out, args.scale)
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit apps with concurrent sessions against one server.")
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=APPS)
+    parser.add_argument("--sessions", type=int, nargs="+", default=DEFAULT_SESSIONS, help="concurrent session counts to measure")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="passes through the interaction script per session")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds per stand-in SPOKE query")
+    parser.add_argument("--fan-out", type=int, default=DEFAULT_FAN_OUT, help="branching factor of the stand-in SPOKE neighbourhood")
+    parser.add_argument("--scale", type=int, default=1, help="multiple of the current bacteria count")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.serve:
+        run_server(args)
+        return
+
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": _environment(),
+        "levels": [
+            run_with_server(args, app, n_sessions)
+            for app in args.apps
+            for n_sessions in args.sessions
+        ],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_server(server, port):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            with urllib.request.urlopen("http://127.0.0.1:{}/_stcore/health".format(port), timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def _process_memory(pid):
+    # VmRSS and VmHWM (peak) of a process in bytes (Linux); empty elsewhere.
+    memory = {}
+    try:
+        with open("/proc/{}/status".format(pid)) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    memory[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return memory
+
+
+if __name__ == "__main__":
+    main()
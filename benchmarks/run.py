@@ -0,0 +1,244 @@
+# Offline benchmarks for the ranking, plotting and graph-building hot paths.
+#
+#   python -m benchmarks.run [--scales 1 10 100] [--fan-outs 2 4 8] [--output bench.json]
+#
+# Run from the repository root. Every scale and the graph benchmarks run in
+# their own subprocess, so module-level state (stores, rank indexes, caches)
+# starts cold and peak memory is not polluted by earlier runs. Tables and
+# plots use synthetic stores with the bacteria axis multiplied by the scale;
+# graph builders consume records from a synthetic SPOKE neighbourhood at the
+# given fan-out. Results are JSON: wall time per call and tracemalloc peak.
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import importlib
+import itertools
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_FAN_OUTS = [2, 4, 8]
+DEFAULT_REPEAT = 20
+BACTERIA_COUNT = 25
+N_COMPOUNDS = 10
+
+
+def measure(name, func, args_cycle, repeat, **params):
+    # Wall time over `repeat` calls (cycling through args_cycle), then one
+    # more call under tracemalloc for the peak; tracing slows the call down,
+    # so it is kept out of the timings.
+    args_cycle = itertools.cycle(args_cycle)
+    wall_times = []
+    for _ in range(repeat):
+        args = next(args_cycle)
+        start = time.perf_counter()
+        func(*args)
+        wall_times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(*next(args_cycle))
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "name": name,
+        "params": params,
+        "repeat": repeat,
+        "wall_time_s": {
+            "min": min(wall_times),
+            "median": statistics.median(wall_times),
+            "mean": statistics.fmean(wall_times),
+            "max": max(wall_times),
+        },
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def timed_import(module_name):
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    return module, time.perf_counter() - start
+
+
+def run_scale(scale, repeat):
+    from data_store import set_bcmm_store, set_dwpc_store
+    from benchmarks.synthetic import synthetic_bcmm_store, synthetic_dwpc_store
+
+    start = time.perf_counter()
+    set_bcmm_store(synthetic_bcmm_store(scale))
+    set_dwpc_store(synthetic_dwpc_store(scale))
+    setup = {"synthetic_data_s": time.perf_counter() - start}
+    app, setup["import_app_s"] = timed_import("app")
+    app_with_netvis, setup["import_app_with_netvis_s"] = timed_import("app_with_netvis")
+    app_metapath_based, setup["import_app_metapath_based_s"] = timed_import("app_metapath_based")
+
+    bcmm_compounds = [(name,) for name in app.compound_names[:N_COMPOUNDS]]
+    dwpc_compounds = [(name,) for name in app_metapath_based.compound_names[:N_COMPOUNDS]]
+    params = {"scale": scale, "n_bacteria": app.store.n_bacteria, "bacteria_count": BACTERIA_COUNT}
+    results = []
+    for label, sort_key in app.SORT_BY_FEATURE.items():
+        results.append(measure(
+            "app.get_bacteria_table",
+            app.get_bacteria_table,
+            [(name, BACTERIA_COUNT, label) for name, in bcmm_compounds],
+            repeat,
+            sort_key=sort_key,
+            **params,
+        ))
+    results.append(measure(
+        "app_with_netvis.get_bacteria_table",
+        app_with_netvis.get_bacteria_table,
+        [(name, BACTERIA_COUNT) for name, in bcmm_compounds],
+        repeat,
+        **params,
+    ))
+    results.append(measure(
+        "app_metapath_based.get_bacteria_table",
+        app_metapath_based.get_bacteria_table,
+        [(name, BACTERIA_COUNT) for name, in dwpc_compounds],
+        repeat,
+        **params,
+    ))
+
+    def build_figure_cold(name):
+        app._figure_cache.clear()
+        app.get_bacteria_figure(name)
+
+    def plot_cold(name):
+        app._figure_cache.clear()
+        app.plot_bacteria_table(name)
+
+    results.append(measure("app.get_bacteria_figure", build_figure_cold, bcmm_compounds, repeat, cache="cold", **params))
+    results.append(measure("app.plot_bacteria_table", plot_cold, bcmm_compounds, repeat, cache="cold", **params))
+    # The cold runs leave the figure cache empty; fill it for the warm run.
+    for name, in bcmm_compounds:
+        app.get_bacteria_figure(name)
+    results.append(measure("app.plot_bacteria_table", app.plot_bacteria_table, bcmm_compounds, repeat, cache="warm", **params))
+    return {"scale": scale, "setup": setup, "results": results}
+
+
+def run_graphs(fan_outs, repeat):
+    from netvis import SPOKE_MAX_GRAPH_EDGES, create_nx_graph, create_nx_graph_v2, create_pyvis_graph, load_metapath_queries
+    from local_engine import metapath_relationship_types
+    from benchmarks.synthetic import ORGANISM_ID, COMPOUND_ID, fan_out_graph
+
+    metapaths = [metapath_relationship_types(query) for query in load_metapath_queries("data/org_cmp_manually_selected_metapath.csv")]
+    results = []
+    for fan_out in fan_outs:
+        driver = fan_out_graph(fan_out)
+        paths = driver.fetch_path(ORGANISM_ID, COMPOUND_ID, 6, fan_out ** 3, 600)
+        metapath_paths = [
+            driver.fetch_path_from_metapath(ORGANISM_ID, COMPOUND_ID, relationship_types, SPOKE_MAX_GRAPH_EDGES)
+            for relationship_types in metapaths
+        ]
+        params = {
+            "fan_out": fan_out,
+            "n_paths": len(paths),
+            "n_metapath_relationships": sum(len(path) for path in metapath_paths),
+        }
+        graph = create_nx_graph(paths)
+        graph_v2 = create_nx_graph_v2(metapath_paths)
+        results.append(measure("netvis.create_nx_graph", create_nx_graph, [(paths,)], repeat, **params))
+        results.append(measure("netvis.create_nx_graph_v2", create_nx_graph_v2, [(metapath_paths,)], repeat, **params))
+        results.append(measure(
+            "netvis.create_pyvis_graph", create_pyvis_graph, [(graph,)], repeat,
+            n_nodes=graph.number_of_nodes(), n_edges=graph.number_of_edges(), **params,
+        ))
+        results.append(measure(
+            "netvis.create_pyvis_graph", create_pyvis_graph, [(graph_v2,)], repeat,
+            source="metapath", n_nodes=graph_v2.number_of_nodes(), n_edges=graph_v2.number_of_edges(), **params,
+        ))
+    return {"fan_outs": fan_outs, "results": results}
+
+
+def run_child(args):
+    os.chdir(REPO_ROOT)
+    # Streamlit elements called outside `streamlit run` log a warning each.
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    if args.child == "scale":
+        report = run_scale(args.scales[0], args.repeat)
+    else:
+        report = run_graphs(args.fan_outs, args.repeat)
+    report["max_rss_bytes"] = _max_rss_bytes()
+    with open(args.child_output, "w") as f:
+        json.dump(report, f)
+
+
+def run_in_subprocess(args, child, extra):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        child_output = f.name
+    command = [
+        sys.executable, "-m", "benchmarks.run",
+        "--child", child,
+        "--child-output", child_output,
+        "--repeat", str(args.repeat),
+    ] + extra
+    try:
+        # pyvis prints notices on stdout, which may be carrying the report.
+        completed = subprocess.run(command, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            return {"error": "exit status {}".format(completed.returncode), "stderr": completed.stderr[-4000:]}
+        with open(child_output) as f:
+            return json.load(f)
+    finally:
+        os.unlink(child_output)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the BCMM ranking, plotting and graph-building hot paths.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="multiples of the current bacteria count")
+    parser.add_argument("--fan-outs", type=int, nargs="+", default=DEFAULT_FAN_OUTS, help="branching factor of the synthetic SPOKE neighbourhood")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--child", choices=["scale", "graphs"], help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        run_child(args)
+        return
+
+    fan_outs = [str(fan_out) for fan_out in args.fan_outs]
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "environment": _environment(),
+        "scales": [
+            dict(run_in_subprocess(args, "scale", ["--scales", str(scale)]), scale=scale)
+            for scale in args.scales
+        ],
+        "graphs": run_in_subprocess(args, "graphs", ["--fan-outs"] + fan_outs),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+def _environment():
+    import numpy
+    import pandas
+    versions = {"python": platform.python_version(), "numpy": numpy.__version__, "pandas": pandas.__version__}
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"platform": platform.platform(), "cpu_count": os.cpu_count(), "versions": versions, "commit": commit or None}
+
+
+def _max_rss_bytes():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+if __name__ == "__main__":
+    main()
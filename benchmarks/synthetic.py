@@ -0,0 +1,103 @@
+import time
+import numpy as np
+import pandas as pd
+from data_store import BcmmStore, DwpcStore
+from local_engine import SNAPSHOT_ARRAYS, LocalSpokeGraph, local_graph_from_frames
+
+
+# Shapes of the shipped datasets; benchmark scales multiply the bacteria axis.
+N_BACTERIA = 3670
+BCMM_COMPOUNDS_PATH = "data/bcmm_compounds_combined_refined.csv"
+DWPC_COMPOUNDS_PATH = "data/cmp_df_selected_with_index.csv"
+ORGANISM_ID = "1"
+COMPOUND_ID = "inchikey:SYNTHETIC"
+
+
+def synthetic_bacteria(n_bacteria):
+    ncbi_id = np.arange(100000, 100000 + n_bacteria)
+    name = np.array(["bacterium {}".format(i) for i in range(n_bacteria)])
+    return ncbi_id, name
+
+
+def synthetic_bcmm_store(scale, seed=0):
+    # Same compound names as the real pickle, random features with the real
+    # value ranges. by_bacterium is a transposed view rather than a copy,
+    # which keeps the 100x dataset within reach of a workstation.
+    rng = np.random.default_rng(seed)
+    compound_names = pd.read_csv(BCMM_COMPOUNDS_PATH).compound_name.tolist()
+    n_bacteria = N_BACTERIA * scale
+    shape = (len(compound_names), n_bacteria)
+    features = {
+        "embedding": rng.random(shape) * 100,
+        "shortest_path_length": rng.integers(1, 7, shape).astype(np.float64),
+        "p_value": rng.random(shape),
+    }
+    ncbi_id, name = synthetic_bacteria(n_bacteria)
+    by_bacterium = {feature: values.T for feature, values in features.items()}
+    return BcmmStore(compound_names, ncbi_id, name, features, by_bacterium=by_bacterium)
+
+
+def synthetic_dwpc_store(scale, seed=0):
+    rng = np.random.default_rng(seed)
+    n_compounds = pd.read_csv(DWPC_COMPOUNDS_PATH).cmp_index.max() + 1
+    n_bacteria = N_BACTERIA * scale
+    by_compound = rng.random((n_compounds, n_bacteria))
+    spoke_id, spoke_name = synthetic_bacteria(n_bacteria)
+    return DwpcStore(by_compound, spoke_id, spoke_name, by_bacterium=by_compound.T)
+
+
+def fan_out_graph(fan_out):
+    # Stand-in for SPOKE around one organism/compound pair: the organism
+    # encodes fan_out proteins, each protein has fan_out ECs, each EC
+    # catalyzes fan_out reactions, and every reaction consumes or produces
+    # the compound. Proteins interact in a ring. netvis dispatches path
+    # queries to a LocalSpokeGraph, so this serves as the fake driver.
+    nodes = [("Organism", ORGANISM_ID, "synthetic organism")]
+    edges = []
+
+    def add_node(label, identifier):
+        nodes.append((label, identifier, "{} {}".format(label, identifier)))
+        return len(nodes) - 1
+
+    compound = add_node("Compound", COMPOUND_ID)
+    proteins = [add_node("Protein", "P{}".format(i)) for i in range(fan_out)]
+    for i, protein in enumerate(proteins):
+        edges.append((0, protein, "ENCODES_OeP"))
+        edges.append((protein, proteins[(i + 1) % fan_out], "INTERACTS_PiP"))
+        for j in range(fan_out):
+            ec = add_node("EC", "EC{}.{}".format(i, j))
+            edges.append((protein, ec, "HAS_PhEC"))
+            for k in range(fan_out):
+                reaction = add_node("Reaction", "R{}.{}.{}".format(i, j, k))
+                edges.append((ec, reaction, "CATALYZES_ECcR"))
+                edges.append((reaction, compound, "CONSUMES_RcC" if k % 2 else "PRODUCES_RpC"))
+    nodes = pd.DataFrame(nodes, columns=["label", "identifier", "name"])
+    nodes["id"] = np.arange(nodes.shape[0])
+    nodes["description"] = nodes["name"]
+    edges = pd.DataFrame(edges, columns=["source", "target", "type"])
+    return local_graph_from_frames(nodes, edges)
+
+
+class StandInSpokeGraph(LocalSpokeGraph):
+    # Answers every organism/compound pair with the synthetic pair's paths
+    # after `latency` seconds per query, like a remote Neo4j round trip.
+    def __init__(self, latency, **arrays):
+        super().__init__(**arrays)
+        self.latency = latency
+
+    def fetch_shortest_path(self, source, target, *args):
+        time.sleep(self.latency)
+        return super().fetch_shortest_path(ORGANISM_ID, COMPOUND_ID, *args)
+
+    def fetch_path(self, source, target, *args):
+        time.sleep(self.latency)
+        return super().fetch_path(ORGANISM_ID, COMPOUND_ID, *args)
+
+    def fetch_path_from_metapath(self, source, target, *args):
+        time.sleep(self.latency)
+        return super().fetch_path_from_metapath(ORGANISM_ID, COMPOUND_ID, *args)
+
+
+def stand_in_spoke(fan_out, latency):
+    graph = fan_out_graph(fan_out)
+    return StandInSpokeGraph(latency, **{key: getattr(graph, key) for key in SNAPSHOT_ARRAYS})
@@ -0,0 +1,139 @@
+import bisect
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+
+BCMM_COMPOUNDS_PATH = "data/bcmm_compounds_combined_refined.csv"
+DWPC_COMPOUNDS_PATH = "data/cmp_df_selected_with_index.csv"
+SEARCH_LIMIT = 50
+MIN_TRIGRAM_SIMILARITY = 0.25
+
+_compound_indexes = {}
+_compound_indexes_lock = threading.Lock()
+
+
+class CompoundIndex:
+    # Built once per catalogue: exact compound names, case-insensitive
+    # aliases (compound name and SPOKE name) -> compound names, compound name
+    # -> SPOKE identifier and DWPC matrix column, a sorted alias list for
+    # prefix search and trigram postings for fuzzy search.
+    def __init__(self, compound_names, identifiers=None, columns=None, aliases=None):
+        self.compound_names = list(compound_names)
+        self.names = {compound_name: compound_name for compound_name in self.compound_names}
+        self.identifiers = dict(identifiers or {})
+        self.columns = dict(columns or {})
+        # Catalogues hold names that differ only by case or equal another
+        # compound's SPOKE name ("deoxycholic acid" / "Deoxycholic acid"), so
+        # an alias key lists every compound it names, own names before any
+        # SPOKE name alias.
+        self.aliases = {}
+        for compound_name in self.compound_names:
+            self.aliases.setdefault(normalize(compound_name), []).append(compound_name)
+        for compound_name in self.compound_names:
+            for alias in (aliases or {}).get(compound_name, []):
+                key_names = self.aliases.setdefault(normalize(alias), [])
+                if compound_name not in key_names:
+                    key_names.append(compound_name)
+        self.alias_keys = sorted(self.aliases)
+        postings = {}
+        self.alias_trigram_counts = np.zeros(len(self.alias_keys), dtype=np.int32)
+        for i, key in enumerate(self.alias_keys):
+            key_trigrams = trigrams(key)
+            self.alias_trigram_counts[i] = len(key_trigrams)
+            for trigram in key_trigrams:
+                postings.setdefault(trigram, []).append(i)
+        self.postings = {trigram: np.array(ids, dtype=np.int32) for trigram, ids in postings.items()}
+
+    def resolve(self, name):
+        # An exact name always resolves to itself; aliases only otherwise.
+        if name in self.names:
+            return name
+        key_names = self.aliases.get(normalize(name))
+        return key_names[0] if key_names else None
+
+    def identifier(self, name):
+        return self.identifiers.get(self.resolve(name))
+
+    def column(self, name):
+        return self.columns.get(self.resolve(name))
+
+    def prefix_search(self, prefix, limit=SEARCH_LIMIT):
+        prefix = normalize(prefix)
+        start = bisect.bisect_left(self.alias_keys, prefix)
+        end = bisect.bisect_right(self.alias_keys, prefix + "\uffff")
+        return _unique(name for key in self.alias_keys[start:end] for name in self.aliases[key])[:limit]
+
+    def fuzzy_search(self, query, limit=SEARCH_LIMIT, min_similarity=MIN_TRIGRAM_SIMILARITY):
+        # Jaccard similarity of trigram sets, counted from the postings of
+        # the query's trigrams only.
+        query_trigrams = [trigram for trigram in trigrams(normalize(query)) if trigram in self.postings]
+        if not query_trigrams:
+            return []
+        hits = np.bincount(np.concatenate([self.postings[trigram] for trigram in query_trigrams]), minlength=len(self.alias_keys))
+        candidates = np.flatnonzero(hits)
+        similarity = hits[candidates] / (len(trigrams(normalize(query))) + self.alias_trigram_counts[candidates] - hits[candidates])
+        keep = similarity >= min_similarity
+        candidates, similarity = candidates[keep], similarity[keep]
+        order = np.argsort(-similarity, kind="stable")
+        return _unique(name for i in candidates[order] for name in self.aliases[self.alias_keys[i]])[:limit]
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        # An exact name first, then prefix matches (alphabetical), then fuzzy
+        # matches by similarity. An empty query lists the whole catalogue, so
+        # it can still be browsed without typing.
+        if not normalize(query):
+            return list(self.compound_names)
+        exact = [query] if query in self.names else []
+        return _unique(exact + self.prefix_search(query, limit) + self.fuzzy_search(query, limit))[:limit]
+
+
+def get_search_term(compound_index, default_selection):
+    # Sidebar typeahead shared by the apps: the selectbox carries the index's
+    # matches for what was typed (the whole catalogue before anything is),
+    # with an exact (case-insensitive or SPOKE name) match preselected.
+    query = st.sidebar.text_input("Search compounds")
+    matches = compound_index.search(query)
+    exact_match = compound_index.resolve(query) if query else None
+    index = matches.index(exact_match) + 1 if exact_match in matches else 0
+    return st.sidebar.selectbox(" ", [default_selection] + matches, index=index)
+
+
+def normalize(name):
+    return " ".join(str(name).lower().split())
+
+
+def trigrams(key):
+    padded = "  " + key + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def compound_index_from_frame(frame, compound_names=None):
+    # frame: compound_name, spoke_name, spoke_identifier[, cmp_index]
+    # compound_names limits the index to what an app offers; names missing
+    # from the frame are still indexed by name.
+    frame = frame.drop_duplicates("compound_name")
+    if compound_names is None:
+        compound_names = sorted(frame.compound_name)
+    frame = frame.set_index("compound_name")
+    identifiers = frame.spoke_identifier.dropna().to_dict()
+    columns = frame.cmp_index.dropna().astype(int).to_dict() if "cmp_index" in frame else {}
+    aliases = {name: [spoke_name] for name, spoke_name in frame.spoke_name.dropna().items()}
+    return CompoundIndex(compound_names, identifiers, columns, aliases)
+
+
+def get_compound_index(csv_path, compound_names=None):
+    # Process-wide, so Streamlit reruns of the page script reuse the index.
+    key = (csv_path, tuple(compound_names) if compound_names is not None else None)
+    index = _compound_indexes.get(key)
+    if index is None:
+        with _compound_indexes_lock:
+            index = _compound_indexes.get(key)
+            if index is None:
+                index = _compound_indexes[key] = compound_index_from_frame(pd.read_csv(csv_path), compound_names)
+    return index
+
+
+def _unique(names):
+    return list(dict.fromkeys(names))
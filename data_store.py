@@ -0,0 +1,244 @@
+import os
+import json
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from metrics import timed
+
+
+BCMM_PICKLE_PATH = os.environ.get("BCMM_PICKLE_PATH", "data/bcmm_compounds_all_bacteria_with_proximity_pvalue.pickle")
+BCMM_CACHE_DIR = os.environ.get("BCMM_CACHE_DIR", "data/cache")
+DWPC_MATRIX_PATH = os.environ.get("BCMM_DWPC_PATH", "data/dwpc_mat_2d.npy")
+DWPC_ORG_PATH = os.environ.get("BCMM_DWPC_ORG_PATH", "data/org_df_selected_with_index.csv")
+# float32 halves the resident size of the DWPC matrix; float64 keeps the source precision.
+DWPC_DTYPE = os.environ.get("BCMM_DWPC_DTYPE", "float64")
+FEATURES = ["embedding", "shortest_path_length", "p_value"]
+BACTERIA_KEYS = ["ncbi_id", "name"]
+CACHE_FORMAT_VERSION = 2
+# Compounds in the pickle that the apps and exports leave out.
+EXCLUDED_COMPOUNDS = [
+    "diacetamate",
+    "azetirelin",
+    "ipsalazide",
+    "indicine n-oxide",
+    "cyclohexylsulfamate",
+    "cortisol",
+]
+
+_store = None
+_store_lock = threading.Lock()
+_dwpc_store = None
+
+
+class BcmmStore:
+    # Compound-major (compounds x bacteria) read-only arrays, so one compound's
+    # feature vector is a contiguous row. by_bacterium holds the transposed
+    # copies for the reverse (bacterium -> compounds) lookup. Arrays are
+    # np.memmap when loaded from the cache directory, which lets every worker
+    # process share the page cache.
+    def __init__(self, compound_names, ncbi_id, name, features, by_bacterium=None):
+        self.compound_names = list(compound_names)
+        self.compound_index = {cmp_name: i for i, cmp_name in enumerate(self.compound_names)}
+        self.ncbi_id = _read_only(ncbi_id)
+        self.name = _read_only(name)
+        self.bacterium_index = {str(ncbi_id): i for i, ncbi_id in enumerate(self.ncbi_id)}
+        for feature in FEATURES:
+            setattr(self, feature, _read_only(features[feature]))
+        if by_bacterium is None:
+            by_bacterium = {feature: np.ascontiguousarray(features[feature].T) for feature in FEATURES}
+        self.by_bacterium = {feature: _read_only(by_bacterium[feature]) for feature in FEATURES}
+
+    @property
+    def n_bacteria(self):
+        return self.ncbi_id.shape[0]
+
+    def compound(self, compound_name):
+        row = self.compound_index[compound_name]
+        return {feature: getattr(self, feature)[row] for feature in FEATURES}
+
+    def bacterium(self, ncbi_id):
+        row = self.bacterium_index[str(ncbi_id)]
+        return {feature: self.by_bacterium[feature][row] for feature in FEATURES}
+
+
+class DwpcStore:
+    # by_compound is the DWPC matrix transposed to compounds x bacteria, so the
+    # scores of one compound are a contiguous, zero-copy row of the memmap.
+    # by_bacterium keeps the source bacteria x compounds layout for the
+    # reverse lookup. spoke_id/spoke_name are aligned with the bacteria axis
+    # (org_index order).
+    def __init__(self, by_compound, spoke_id, spoke_name, by_bacterium=None):
+        self.by_compound = _read_only(by_compound)
+        if by_bacterium is None:
+            by_bacterium = np.ascontiguousarray(self.by_compound.T)
+        self.by_bacterium = _read_only(by_bacterium)
+        self.spoke_id = _read_only(spoke_id)
+        self.spoke_name = _read_only(spoke_name)
+        self.bacterium_index = {str(spoke_id): i for i, spoke_id in enumerate(self.spoke_id)}
+
+    @property
+    def n_bacteria(self):
+        return self.by_compound.shape[1]
+
+    def column(self, cmp_index):
+        return self.by_compound[cmp_index]
+
+    def row(self, spoke_id):
+        return self.by_bacterium[self.bacterium_index[str(spoke_id)]]
+
+
+def get_bcmm_store(pickle_path=None, cache_dir=None):
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = load_bcmm_store(pickle_path or BCMM_PICKLE_PATH, cache_dir or BCMM_CACHE_DIR)
+    return _store
+
+
+def set_bcmm_store(store):
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def get_dwpc_store(matrix_path=None, org_path=None, cache_dir=None, dtype=None):
+    global _dwpc_store
+    if _dwpc_store is None:
+        with _store_lock:
+            if _dwpc_store is None:
+                _dwpc_store = load_dwpc_store(
+                    matrix_path or DWPC_MATRIX_PATH,
+                    org_path or DWPC_ORG_PATH,
+                    cache_dir or BCMM_CACHE_DIR,
+                    dtype or DWPC_DTYPE,
+                )
+    return _dwpc_store
+
+
+def set_dwpc_store(store):
+    global _dwpc_store
+    with _store_lock:
+        _dwpc_store = store
+
+
+@timed("data_store.load_dwpc_store")
+def load_dwpc_store(matrix_path, org_path, cache_dir, dtype):
+    org_df = pd.read_csv(org_path).sort_values("org_index")
+    spoke_id = org_df.spoke_id.values
+    spoke_name = org_df.spoke_name.values.astype(str)
+    layouts = {"dwpc_by_compound": lambda matrix: matrix.T, "dwpc_by_bacterium": lambda matrix: matrix}
+    arrays = {}
+    if cache_dir:
+        manifest = dict(_source_manifest(matrix_path), dtype=dtype)
+        for key, layout in layouts.items():
+            prefix = os.path.join(cache_dir, key)
+            arrays[key] = _open_cached_array(prefix, manifest)
+            if arrays[key] is None:
+                try:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    matrix = np.load(matrix_path, mmap_mode="r")
+                    _atomic_write(prefix + ".npy", lambda f: np.save(f, np.ascontiguousarray(layout(matrix), dtype=dtype)), "wb")
+                    _atomic_write(prefix + ".manifest.json", lambda f: json.dump(manifest, f), "w")
+                    arrays[key] = _open_cached_array(prefix, manifest)
+                except OSError:
+                    pass
+    if arrays.get("dwpc_by_compound") is None:
+        return DwpcStore(np.ascontiguousarray(np.load(matrix_path).T, dtype=dtype), spoke_id, spoke_name)
+    return DwpcStore(arrays["dwpc_by_compound"], spoke_id, spoke_name, by_bacterium=arrays.get("dwpc_by_bacterium"))
+
+
+@timed("data_store.load_bcmm_store")
+def load_bcmm_store(pickle_path, cache_dir):
+    manifest = _source_manifest(pickle_path)
+    if cache_dir:
+        store = _open_cache(cache_dir, manifest)
+        if store is not None:
+            return store
+    store = _store_from_pickle(pickle_path)
+    if cache_dir:
+        try:
+            _write_cache(store, cache_dir, manifest)
+            return _open_cache(cache_dir, manifest) or store
+        except OSError:
+            pass
+    return store
+
+
+def _store_from_pickle(pickle_path):
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    compound_names = [key for key in data.keys() if key not in BACTERIA_KEYS]
+    features = {
+        feature: np.stack([np.asarray(data[cmp_name][feature]) for cmp_name in compound_names])
+        for feature in FEATURES
+    }
+    return BcmmStore(compound_names, np.asarray(data["ncbi_id"]), np.asarray(data["name"], dtype=str), features)
+
+
+def _source_manifest(source_path):
+    stat = os.stat(source_path)
+    return {
+        "version": CACHE_FORMAT_VERSION,
+        "source": os.path.abspath(source_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def _open_cache(cache_dir, manifest):
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    try:
+        with open(manifest_path) as f:
+            if json.load(f) != manifest:
+                return None
+        with open(os.path.join(cache_dir, "compound_names.json")) as f:
+            compound_names = json.load(f)
+        arrays = {
+            key: np.load(os.path.join(cache_dir, key + ".npy"), mmap_mode="r")
+            for key in FEATURES + BACTERIA_KEYS + _by_bacterium_keys()
+        }
+    except (OSError, ValueError):
+        return None
+    by_bacterium = {feature: arrays[feature + "_by_bacterium"] for feature in FEATURES}
+    return BcmmStore(compound_names, arrays["ncbi_id"], arrays["name"], arrays, by_bacterium=by_bacterium)
+
+
+def _open_cached_array(prefix, manifest):
+    try:
+        with open(prefix + ".manifest.json") as f:
+            if json.load(f) != manifest:
+                return None
+        return np.load(prefix + ".npy", mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(store, cache_dir, manifest):
+    os.makedirs(cache_dir, exist_ok=True)
+    for key in FEATURES + BACTERIA_KEYS:
+        _atomic_write(os.path.join(cache_dir, key + ".npy"), lambda f, key=key: np.save(f, np.ascontiguousarray(getattr(store, key))), "wb")
+    for feature in FEATURES:
+        _atomic_write(os.path.join(cache_dir, feature + "_by_bacterium.npy"), lambda f, feature=feature: np.save(f, store.by_bacterium[feature]), "wb")
+    _atomic_write(os.path.join(cache_dir, "compound_names.json"), lambda f: json.dump(store.compound_names, f), "w")
+    # The manifest goes last: a reader only trusts the arrays once it matches.
+    _atomic_write(os.path.join(cache_dir, "manifest.json"), lambda f: json.dump(manifest, f), "w")
+
+
+def _by_bacterium_keys():
+    return [feature + "_by_bacterium" for feature in FEATURES]
+
+
+def _atomic_write(path, write, mode):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, mode) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _read_only(array):
+    if isinstance(array, np.ndarray) and array.flags.writeable:
+        array = array.view()
+        array.setflags(write=False)
+    return array
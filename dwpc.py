@@ -0,0 +1,163 @@
+# Local DWPC (degree-weighted path count) for the organism x compound matrix
+# the metapath app serves, computed from an exported SPOKE snapshot (see
+# local_engine.py) instead of the external batch job:
+#
+#   python dwpc.py --snapshot data/spoke_snapshot --compound "cholic acid" ...
+#   python dwpc.py --snapshot data/spoke_snapshot --all-compounds
+#   python dwpc.py --snapshot data/spoke_snapshot --refresh
+#
+# New compounds are appended as columns of data/dwpc_mat_2d.npy and rows of
+# data/cmp_df_selected_with_index.csv; existing columns are only recomputed
+# with --refresh (e.g. after editing the metapath CSV). Both files are
+# replaced atomically, and the data_store cache notices the new matrix.
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from compound_index import BCMM_COMPOUNDS_PATH, DWPC_COMPOUNDS_PATH
+from data_store import DWPC_MATRIX_PATH, DWPC_ORG_PATH
+from local_engine import load_local_graph, metapath_relationship_types
+from metrics import timed
+from netvis import SPOKE_LOCAL_SNAPSHOT, load_metapath_queries
+
+
+METAPATH_PATH = "data/org_cmp_manually_selected_metapath.csv"
+# Damping exponent w of the degree weighting, as in Hetionet.
+DWPC_DAMPING = float(os.environ.get("BCMM_DWPC_DAMPING", 0.4))
+LOCAL_ANNOTATION = "computed locally from SPOKE snapshot"
+
+
+class DwpcEngine:
+    # One degree-weighted adjacency per relationship type, built lazily:
+    # W = D^-w A D^-w over the type's edges taken in both directions, with D
+    # the node degrees in that type. The DWPC of a metapath is then the chain
+    # product of its W matrices between organism rows and compound columns.
+    # Chains are walks, so paths revisiting a node (possible through
+    # INTERACTS_PiP) are counted too.
+    def __init__(self, graph, damping=DWPC_DAMPING):
+        self.graph = graph
+        self.damping = damping
+        self.weighted = {}
+
+    def weighted_adjacency(self, relationship_type):
+        if relationship_type not in self.weighted:
+            graph = self.graph
+            mask = graph.edge_type == graph.type_codes.get(relationship_type, -1)
+            src, dst = graph.edge_src[mask], graph.edge_dst[mask]
+            rows = np.concatenate([src, dst])
+            cols = np.concatenate([dst, src])
+            adjacency = sp.csr_matrix((np.ones(rows.shape[0]), (rows, cols)), shape=(graph.n_nodes, graph.n_nodes))
+            # Parallel edges count once.
+            adjacency.data[:] = 1.0
+            degree = np.asarray(adjacency.sum(axis=1)).ravel()
+            scale = np.zeros(graph.n_nodes)
+            np.power(degree, -self.damping, out=scale, where=degree > 0)
+            self.weighted[relationship_type] = (sp.diags(scale) @ adjacency @ sp.diags(scale)).tocsr()
+        return self.weighted[relationship_type]
+
+    def metapath_dwpc(self, relationship_types, organism_nodes, compound_nodes):
+        # Right to left, so every intermediate product has only as many
+        # columns as there are compounds.
+        product = self.weighted_adjacency(relationship_types[-1])[:, compound_nodes]
+        for relationship_type in reversed(relationship_types[1:-1]):
+            product = self.weighted_adjacency(relationship_type) @ product
+        if len(relationship_types) > 1:
+            product = self.weighted_adjacency(relationship_types[0])[organism_nodes] @ product
+        else:
+            product = product[organism_nodes]
+        return product.toarray()
+
+    @timed("dwpc.compute")
+    def compute(self, metapaths, organism_ids, compound_identifiers):
+        # organisms x compounds, summed over the metapaths. Organisms and
+        # compounds missing from the snapshot get 0.
+        organism_nodes = [self.graph.find_node("Organism", organism_id) for organism_id in organism_ids]
+        compound_nodes = [self.graph.find_node("Compound", identifier) for identifier in compound_identifiers]
+        organism_present = np.array([node is not None for node in organism_nodes], dtype=bool)
+        compound_present = np.array([node is not None for node in compound_nodes], dtype=bool)
+        dwpc = np.zeros((len(organism_nodes), len(compound_nodes)))
+        if not organism_present.any() or not compound_present.any():
+            return dwpc
+        organism_rows = np.array([node for node in organism_nodes if node is not None])
+        compound_cols = np.array([node for node in compound_nodes if node is not None])
+        summed = sum(self.metapath_dwpc(relationship_types, organism_rows, compound_cols) for relationship_types in metapaths)
+        dwpc[np.ix_(organism_present, compound_present)] = summed
+        return dwpc
+
+
+def load_metapaths(metapath_path=METAPATH_PATH):
+    return [metapath_relationship_types(query) for query in load_metapath_queries(metapath_path)]
+
+
+def select_compounds(catalogue, cmp_df, names=(), all_compounds=False, refresh=False):
+    # Returns catalogue rows (compound_name, spoke_name, spoke_identifier) to
+    # compute: the named or all catalogue compounds not yet in the matrix,
+    # plus every existing compound when refreshing.
+    catalogue = catalogue.dropna(subset=["spoke_identifier"]).drop_duplicates("compound_name").set_index("compound_name")
+    if all_compounds:
+        names = list(catalogue.index)
+    unknown = [name for name in names if name not in catalogue.index and name not in set(cmp_df.compound_name)]
+    if unknown:
+        raise ValueError("Not in the compound catalogue: {}".format(", ".join(unknown)))
+    existing = set(cmp_df.compound_name)
+    selected = [name for name in dict.fromkeys(names) if name not in existing]
+    rows = catalogue.loc[selected, ["spoke_name", "spoke_identifier"]].reset_index()
+    if refresh:
+        rows = pd.concat([cmp_df[["compound_name", "spoke_name", "spoke_identifier"]], rows], ignore_index=True)
+    return rows
+
+
+def update_dwpc_matrix(engine, metapaths, compounds, matrix_path=DWPC_MATRIX_PATH, cmp_path=DWPC_COMPOUNDS_PATH, org_path=DWPC_ORG_PATH):
+    # Computes the given compounds and writes their columns: existing
+    # compounds keep their cmp_index, new ones are appended after the last.
+    org_df = pd.read_csv(org_path).sort_values("org_index")
+    cmp_df = pd.read_csv(cmp_path, index_col=0)
+    matrix = np.load(matrix_path)
+    if compounds.shape[0] == 0:
+        return 0, 0
+    dwpc = engine.compute(metapaths, org_df.spoke_id.astype(str).values, compounds.spoke_identifier.values)
+    cmp_indexes = dict(zip(cmp_df.compound_name, cmp_df.cmp_index))
+    new_rows = []
+    for compound_name, spoke_name in zip(compounds.compound_name, compounds.spoke_name):
+        if compound_name not in cmp_indexes:
+            cmp_indexes[compound_name] = matrix.shape[1] + len(new_rows)
+            new_rows.append({"cmp_index": cmp_indexes[compound_name], "compound_name": compound_name, "spoke_name": spoke_name, "annotation": LOCAL_ANNOTATION})
+    if new_rows:
+        matrix = np.concatenate([matrix, np.zeros((matrix.shape[0], len(new_rows)), dtype=matrix.dtype)], axis=1)
+        new_df = pd.DataFrame(new_rows).merge(compounds[["compound_name", "spoke_identifier"]], on="compound_name")
+        # Nullable integers, so the blank fields of new rows keep the other rows' formatting.
+        cmp_df = cmp_df.astype({column: "Int64" for column in cmp_df.select_dtypes("integer").columns})
+        cmp_df = pd.concat([cmp_df, new_df], ignore_index=True)[cmp_df.columns]
+    matrix[:, [cmp_indexes[compound_name] for compound_name in compounds.compound_name]] = dwpc
+    _atomic_save(matrix_path, lambda f: np.save(f, matrix))
+    if new_rows:
+        _atomic_save(cmp_path, lambda f: cmp_df.to_csv(f))
+    return len(new_rows), compounds.shape[0] - len(new_rows)
+
+
+def _atomic_save(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute DWPC columns for compounds from a local SPOKE snapshot.")
+    parser.add_argument("--snapshot", default=SPOKE_LOCAL_SNAPSHOT, help="exported SPOKE subgraph directory")
+    parser.add_argument("--compound", nargs="+", default=[], help="compound names from the compound catalogue to add")
+    parser.add_argument("--all-compounds", action="store_true", help="add every catalogue compound not yet in the matrix")
+    parser.add_argument("--refresh", action="store_true", help="recompute the compounds already in the matrix as well")
+    parser.add_argument("--catalogue", default=BCMM_COMPOUNDS_PATH, help="CSV with compound_name, spoke_name, spoke_identifier")
+    parser.add_argument("--metapaths", default=METAPATH_PATH)
+    parser.add_argument("--damping", type=float, default=DWPC_DAMPING)
+    args = parser.parse_args(argv)
+    compounds = select_compounds(pd.read_csv(args.catalogue), pd.read_csv(DWPC_COMPOUNDS_PATH, index_col=0), args.compound, args.all_compounds, args.refresh)
+    engine = DwpcEngine(load_local_graph(args.snapshot), args.damping)
+    added, refreshed = update_dwpc_matrix(engine, load_metapaths(args.metapaths), compounds)
+    print("Added {} and refreshed {} compounds in {}".format(added, refreshed, DWPC_MATRIX_PATH))
+
+
+if __name__ == "__main__":
+    main()
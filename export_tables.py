@@ -0,0 +1,128 @@
+# Headless export of the ranked bacteria tables the apps show, for every
+# compound and every sort key, as one hive-partitioned Parquet dataset:
+#
+#   <output>/source=bcmm/compound=<name>/part-0.parquet
+#   <output>/source=dwpc/compound=<name>/part-0.parquet
+#
+#   python export_tables.py --output data/export --top-n 100 --workers 4
+#
+# Read it back with pyarrow.dataset.dataset(output, partitioning="hive").
+# Each worker ranks and writes one compound at a time, so memory stays at
+# one compound's tables per worker however many compounds there are.
+import os
+import argparse
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from data_store import EXCLUDED_COMPOUNDS, get_bcmm_store, get_dwpc_store
+from ranking import BCMM_SORT_KEYS, ranked_bacteria_table, ranked_dwpc_table
+
+
+SOURCES = ["bcmm", "dwpc"]
+DWPC_COMPOUNDS_PATH = "data/cmp_df_selected_with_index.csv"
+# One schema for both sources; columns a source does not have are null.
+EXPORT_SCHEMA = pa.schema([
+    ("sort_key", pa.string()),
+    ("rank", pa.int32()),
+    ("ncbi_id", pa.string()),
+    ("name", pa.string()),
+    ("embedding", pa.float64()),
+    ("shortest_path_length", pa.float64()),
+    ("p_value", pa.float64()),
+    ("dwpc", pa.float64()),
+])
+
+
+def bcmm_compounds():
+    store = get_bcmm_store()
+    return sorted(set(store.compound_names) - set(EXCLUDED_COMPOUNDS))
+
+
+def dwpc_compounds():
+    cmp_df = pd.read_csv(DWPC_COMPOUNDS_PATH)
+    return sorted(zip(cmp_df.compound_name, cmp_df.cmp_index))
+
+
+def bcmm_compound_table(compound_name, top_n):
+    store = get_bcmm_store()
+    tables = []
+    for sort_key in BCMM_SORT_KEYS:
+        table = ranked_bacteria_table(store, None, compound_name, sort_key, top_n or store.n_bacteria)
+        table.insert(0, "sort_key", sort_key)
+        table.insert(1, "rank", np.arange(1, table.shape[0] + 1, dtype=np.int32))
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+def dwpc_compound_table(cmp_index, top_n):
+    store = get_dwpc_store()
+    table = ranked_dwpc_table(store, None, cmp_index, top_n or store.n_bacteria)
+    table = table.rename(columns={"spoke_id": "ncbi_id", "spoke_name": "name"})
+    table.insert(0, "sort_key", "dwpc")
+    table.insert(1, "rank", np.arange(1, table.shape[0] + 1, dtype=np.int32))
+    return table
+
+
+def partition_path(output, source, compound_name):
+    return os.path.join(output, "source=" + source, "compound=" + urllib.parse.quote(compound_name, safe=""), "part-0.parquet")
+
+
+def write_partition(table, path):
+    table = table.assign(ncbi_id=table.ncbi_id.astype(str))
+    for column in EXPORT_SCHEMA.names:
+        if column not in table:
+            table[column] = None
+    arrow_table = pa.Table.from_pandas(table[EXPORT_SCHEMA.names], schema=EXPORT_SCHEMA, preserve_index=False)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    pq.write_table(arrow_table, tmp_path)
+    os.replace(tmp_path, path)
+    return arrow_table.num_rows
+
+
+def export_compound(output, source, compound_name, cmp_index, top_n):
+    if source == "bcmm":
+        table = bcmm_compound_table(compound_name, top_n)
+    else:
+        table = dwpc_compound_table(cmp_index, top_n)
+    return source, compound_name, write_partition(table, partition_path(output, source, compound_name))
+
+
+def export_tables(output, sources=SOURCES, top_n=100, workers=None):
+    # Stores are opened here first so the memmap caches exist before the
+    # workers start; forked workers then share the mapped pages.
+    tasks = []
+    if "bcmm" in sources:
+        tasks += [("bcmm", compound_name, None) for compound_name in bcmm_compounds()]
+    if "dwpc" in sources:
+        get_dwpc_store()
+        tasks += [("dwpc", compound_name, cmp_index) for compound_name, cmp_index in dwpc_compounds()]
+    n_rows = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(export_compound, output, source, compound_name, cmp_index, top_n)
+            for source, compound_name, cmp_index in tasks
+        ]
+        for i, future in enumerate(as_completed(futures), 1):
+            source, compound_name, rows = future.result()
+            n_rows += rows
+            print("[{}/{}] {} {}: {} rows".format(i, len(futures), source, compound_name, rows), flush=True)
+    return len(tasks), n_rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export ranked bacteria tables for every compound as partitioned Parquet.")
+    parser.add_argument("--output", required=True, help="dataset root directory")
+    parser.add_argument("--sources", nargs="+", choices=SOURCES, default=SOURCES)
+    parser.add_argument("--top-n", type=int, default=100, help="bacteria per compound and sort key; 0 exports all")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    n_compounds, n_rows = export_tables(args.output, args.sources, args.top_n, args.workers)
+    print("Exported {} rows for {} compounds to {}".format(n_rows, n_compounds, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+SPOKE_LAYOUT = os.environ.get("SPOKE_LAYOUT", "layered")
+SPOKE_LAYOUT_CACHE_SIZE = int(os.environ.get("SPOKE_LAYOUT_CACHE_SIZE", 256))
+LAYER_SPACING = 300
+NODE_SPACING = 60
+# Every metapath runs Organism -> Protein -> EC -> Reaction -> Compound; nodes
+# not reachable from an organism fall back to this order.
+NODE_TYPE_ORDER = {"Organism": 0, "Protein": 1, "EC": 2, "Reaction": 3, "Compound": 4}
+
+_layout_cache = OrderedDict()
+_layout_cache_lock = threading.Lock()
+
+
+def hop_layers(node_types, edge_src, edge_dst):
+    # Undirected BFS hop index from the Organism node(s), one vectorized
+    # frontier step over the edge arrays per hop.
+    n_nodes = node_types.shape[0]
+    layer = np.full(n_nodes, -1, dtype=np.int64)
+    frontier = node_types == "Organism"
+    layer[frontier] = 0
+    depth = 0
+    while frontier.any():
+        depth += 1
+        reached = np.zeros(n_nodes, dtype=bool)
+        reached[edge_dst[frontier[edge_src]]] = True
+        reached[edge_src[frontier[edge_dst]]] = True
+        reached &= layer < 0
+        layer[reached] = depth
+        frontier = reached
+    unreached = layer < 0
+    type_rank = np.array([NODE_TYPE_ORDER.get(node_type, len(NODE_TYPE_ORDER)) for node_type in node_types], dtype=np.int64)
+    layer[unreached] = type_rank[unreached]
+    return layer
+
+
+def layered_layout(node_types, edge_src, edge_dst):
+    # Columns by hop index; within a column nodes are ordered by the mean
+    # position of their neighbours in earlier columns to limit crossings.
+    layer = hop_layers(node_types, edge_src, edge_dst)
+    x = layer * float(LAYER_SPACING)
+    y = np.zeros(node_types.shape[0])
+    ends = np.concatenate([edge_src, edge_dst])
+    others = np.concatenate([edge_dst, edge_src])
+    for current in np.unique(layer):
+        members = np.flatnonzero(layer == current)
+        back = layer[others] < current
+        sums = np.bincount(ends[back], weights=y[others[back]], minlength=y.shape[0]).astype(float)
+        counts = np.bincount(ends[back], minlength=y.shape[0])
+        barycenter = np.divide(sums, counts, out=np.zeros(y.shape[0]), where=counts > 0)
+        members = members[np.argsort(barycenter[members], kind="stable")]
+        y[members] = (np.arange(members.shape[0]) - (members.shape[0] - 1) / 2) * NODE_SPACING
+    return np.column_stack([x, y])
+
+
+def force_directed_layout(node_types, edge_src, edge_dst, iterations=50, seed=0):
+    # Fruchterman-Reingold with all pairwise repulsions computed as dense
+    # n x n arrays per iteration; started from the layered layout.
+    n_nodes = node_types.shape[0]
+    if n_nodes < 2:
+        return np.zeros((n_nodes, 2))
+    position = layered_layout(node_types, edge_src, edge_dst)
+    position = (position / max(np.abs(position).max(), 1.0)).astype(np.float32)
+    position += np.random.default_rng(seed).normal(scale=1e-3, size=position.shape).astype(np.float32)
+    k = np.sqrt(1.0 / n_nodes)
+    temperature = 0.1
+    for _ in range(iterations):
+        dx = np.subtract.outer(position[:, 0], position[:, 0])
+        dy = np.subtract.outer(position[:, 1], position[:, 1])
+        repulsion = k * k / np.maximum(dx * dx + dy * dy, 1e-6)
+        displacement = np.column_stack([(dx * repulsion).sum(axis=1), (dy * repulsion).sum(axis=1)])
+        edge_delta = position[edge_src] - position[edge_dst]
+        edge_length = np.maximum(np.linalg.norm(edge_delta, axis=-1), 1e-3)
+        attraction = edge_delta * (edge_length / k)[:, None]
+        np.subtract.at(displacement, edge_src, attraction)
+        np.add.at(displacement, edge_dst, attraction)
+        length = np.maximum(np.linalg.norm(displacement, axis=-1), 1e-9)
+        position += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature *= 0.95
+    return position * NODE_SPACING * np.sqrt(n_nodes)
+
+
+LAYOUTS = {"layered": layered_layout, "force": force_directed_layout}
+
+
+def compute_layout(node_ids, node_types, edges, layout=None):
+    index = {node_id: i for i, node_id in enumerate(node_ids)}
+    edge_src = np.fromiter((index[source] for source, target in edges), dtype=np.int64, count=len(edges))
+    edge_dst = np.fromiter((index[target] for source, target in edges), dtype=np.int64, count=len(edges))
+    position = LAYOUTS[layout or SPOKE_LAYOUT](np.asarray(node_types, dtype=str), edge_src, edge_dst)
+    return {node_id: (float(x), float(y)) for node_id, (x, y) in zip(node_ids, position)}
+
+
+def cached_layout(key, node_ids, node_types, edges, layout=None):
+    # key identifies the view, e.g. (organism, compound); the node and edge
+    # sets are part of the cache key so partial and complete graphs differ.
+    key = (key, layout or SPOKE_LAYOUT, hash((tuple(node_ids), tuple(edges))))
+    with _layout_cache_lock:
+        if key in _layout_cache:
+            _layout_cache.move_to_end(key)
+            return _layout_cache[key]
+    positions = compute_layout(node_ids, node_types, edges, layout)
+    with _layout_cache_lock:
+        _layout_cache[key] = positions
+        while len(_layout_cache) > SPOKE_LAYOUT_CACHE_SIZE:
+            _layout_cache.popitem(last=False)
+    return positions
@@ -0,0 +1,295 @@
+import os
+import re
+import json
+import time
+import numpy as np
+import pandas as pd
+from data_store import _atomic_write, _source_manifest
+from path_cache import PartialResult
+from spoke_records import SpokeNode, SpokeRelationship
+
+
+# An exported SPOKE subgraph is a directory with
+#   nodes.csv: id, label, identifier, name, description
+#   edges.csv: source, target, type   (source/target refer to nodes.csv id)
+# It is parsed once into graph.npz next to the CSVs.
+SNAPSHOT_ARRAYS = ["labels", "label_names", "identifier", "name", "description", "edge_src", "edge_dst", "edge_type", "type_names"]
+METAPATH_RELATIONSHIP_PATTERN = re.compile(r"\[:(\w+)\]")
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class LocalSpokeGraph:
+    # Typed CSR adjacency over both edge directions: the neighbours of node i
+    # are adj_node[indptr[i]:indptr[i+1]], reached through relationship
+    # adj_edge[...] (adj_forward is False when walking it against its direction).
+    def __init__(self, labels, label_names, identifier, name, description, edge_src, edge_dst, edge_type, type_names):
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self.label_names = [str(label) for label in label_names]
+        self.identifier = np.asarray(identifier, dtype=str)
+        self.name = np.asarray(name, dtype=str)
+        self.description = np.asarray(description, dtype=str)
+        self.edge_src = np.asarray(edge_src, dtype=np.int64)
+        self.edge_dst = np.asarray(edge_dst, dtype=np.int64)
+        self.edge_type = np.asarray(edge_type, dtype=np.int32)
+        self.type_names = [str(type_name) for type_name in type_names]
+        self.label_codes = {label: i for i, label in enumerate(self.label_names)}
+        self.type_codes = {type_name: i for i, type_name in enumerate(self.type_names)}
+
+        n_nodes = self.labels.shape[0]
+        n_edges = self.edge_src.shape[0]
+        origin = np.concatenate([self.edge_src, self.edge_dst])
+        order = np.argsort(origin, kind="stable")
+        self.adj_node = np.concatenate([self.edge_dst, self.edge_src])[order]
+        self.adj_edge = np.tile(np.arange(n_edges), 2)[order]
+        self.adj_forward = np.repeat([True, False], n_edges)[order]
+        self.indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(origin, minlength=n_nodes), out=self.indptr[1:])
+        self.node_lookup = {
+            (self.label_names[label], identifier): i
+            for i, (label, identifier) in enumerate(zip(self.labels, self.identifier))
+        }
+
+    @property
+    def n_nodes(self):
+        return self.labels.shape[0]
+
+    def close(self):
+        pass
+
+    def save(self, path):
+        np.savez(path, **{key: np.asarray(getattr(self, key)) for key in SNAPSHOT_ARRAYS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(**{key: arrays[key] for key in SNAPSHOT_ARRAYS})
+
+    def find_node(self, label, identifier):
+        return self.node_lookup.get((label, str(identifier)))
+
+    def has_label(self, node, label):
+        return self.labels[node] == self.label_codes.get(label, -1)
+
+    def node(self, node):
+        properties = {
+            key: str(values[node])
+            for key, values in (("identifier", self.identifier), ("name", self.name), ("description", self.description))
+            if values[node]
+        }
+        return SpokeNode(int(node), [self.label_names[self.labels[node]]], properties)
+
+    def relationship(self, edge):
+        return SpokeRelationship(
+            int(edge),
+            self.type_names[self.edge_type[edge]],
+            self.node(self.edge_src[edge]),
+            self.node(self.edge_dst[edge]),
+        )
+
+    def expand(self, frontier, relationship_type=None, direction=None):
+        # Vectorized one-hop expansion of a node set; returns parallel arrays
+        # (origin node, neighbour node, relationship) for every matching edge.
+        frontier = np.asarray(frontier, dtype=np.int64)
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        slots = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        origins = np.repeat(frontier, counts)
+        mask = np.ones(slots.shape[0], dtype=bool)
+        if relationship_type is not None:
+            mask &= self.edge_type[self.adj_edge[slots]] == self.type_codes.get(relationship_type, -1)
+        if direction == "out":
+            mask &= self.adj_forward[slots]
+        elif direction == "in":
+            mask &= ~self.adj_forward[slots]
+        slots = slots[mask]
+        return origins[mask], self.adj_node[slots], self.adj_edge[slots]
+
+    def all_shortest_paths(self, start, end, max_hops, limit, deadline=None):
+        # Undirected BFS from start, then every shortest path is walked back
+        # from end through nodes one hop closer; paths are relationship ids.
+        # The walk can take as long as there are shortest paths, so it checks
+        # the deadline too, not only the BFS.
+        dist = np.full(self.n_nodes, -1, dtype=np.int32)
+        dist[start] = 0
+        frontier = np.array([start])
+        hops = 0
+        while dist[end] < 0 and frontier.size and hops < max_hops:
+            _check_deadline(deadline)
+            _, neighbors, _ = self.expand(frontier)
+            frontier = np.unique(neighbors[dist[neighbors] < 0])
+            hops += 1
+            dist[frontier] = hops
+        if dist[end] <= 0:
+            return []
+        paths = []
+
+        def walk(node, suffix):
+            if len(paths) >= limit:
+                return
+            _check_deadline(deadline)
+            if node == start:
+                paths.append(tuple(suffix))
+                return
+            _, neighbors, edges = self.expand([node])
+            for neighbor, edge in zip(neighbors, edges):
+                if dist[neighbor] == dist[node] - 1:
+                    walk(neighbor, [edge] + suffix)
+
+        walk(end, [])
+        return paths
+
+    def directed_walks(self, node, min_hops, max_hops, deadline=None):
+        walks = [((), node)]
+        for hops in range(1, max_hops + 1):
+            _check_deadline(deadline)
+            next_walks = []
+            for edges, end in walks:
+                _, neighbors, next_edges = self.expand([end], direction="out")
+                next_walks.extend((edges + (edge,), neighbor) for neighbor, edge in zip(neighbors, next_edges))
+            walks = next_walks
+            if hops >= min_hops:
+                yield from walks
+
+    def organism_reaction_paths(self, organism, deadline=None):
+        # Organism -ENCODES_OeP-> Protein -HAS_PhEC-> EC, then either
+        # -ISA_ECiEC-> EC -[*1..2]-> Reaction or -[*1..2]-> Reaction.
+        seen = set()
+        _, proteins, encodes = self.expand([organism], "ENCODES_OeP", "out")
+        for protein, encode in zip(proteins, encodes):
+            if not self.has_label(protein, "Protein"):
+                continue
+            _, ecs, has_ecs = self.expand([protein], "HAS_PhEC", "out")
+            for ec, has_ec in zip(ecs, has_ecs):
+                if not self.has_label(ec, "EC"):
+                    continue
+                prefix = (encode, has_ec)
+                _, parent_ecs, isas = self.expand([ec], "ISA_ECiEC", "out")
+                starts = [(prefix + (isa,), parent_ec) for parent_ec, isa in zip(parent_ecs, isas) if self.has_label(parent_ec, "EC")]
+                starts.append((prefix, ec))
+                for start_edges, start in starts:
+                    for edges, reaction in self.directed_walks(start, 1, 2, deadline):
+                        path = start_edges + edges
+                        if self.has_label(reaction, "Reaction") and path not in seen:
+                            seen.add(path)
+                            yield path, reaction
+
+    def fetch_shortest_path(self, source, target, max_hops, row_budget, timeout):
+        organism = self.find_node("Organism", source)
+        compound = self.find_node("Compound", target)
+        if organism is None or compound is None:
+            return []
+        try:
+            paths = self.all_shortest_paths(compound, organism, max_hops, row_budget, time.monotonic() + timeout)
+        except BudgetExceeded:
+            return PartialResult()
+        return [self.path(edges) for edges in paths]
+
+    def fetch_path(self, source, target, max_hops, row_budget, timeout):
+        deadline = time.monotonic() + timeout
+        organism = self.find_node("Organism", source)
+        compound = self.find_node("Compound", target)
+        if organism is None or compound is None:
+            return []
+        paths = []
+        reaction_paths = {}
+        try:
+            for path1, reaction in self.organism_reaction_paths(organism, deadline):
+                if reaction not in reaction_paths:
+                    reaction_paths[reaction] = self.all_shortest_paths(reaction, compound, max_hops, row_budget, deadline)
+                for path2 in reaction_paths[reaction]:
+                    paths.append(self.path(path1))
+                    paths.append(self.path(path2))
+                    if len(paths) >= 2 * row_budget:
+                        return paths
+        except BudgetExceeded:
+            return PartialResult(paths)
+        if len(paths) == 0:
+            return self.fetch_shortest_path(source, target, max_hops, row_budget, deadline - time.monotonic())
+        return paths
+
+    def fetch_path_from_metapath(self, source, target, relationship_types, max_edges):
+        # Forward layers from the organism along the metapath, then a backward
+        # sweep from the compound keeps only relationships on complete paths.
+        organism = self.find_node("Organism", source)
+        compound = self.find_node("Compound", target)
+        if organism is None or compound is None:
+            return []
+        frontier = np.array([organism])
+        hops = []
+        for i, relationship_type in enumerate(relationship_types):
+            hop = self.expand(frontier, relationship_type, "out" if i == 0 else None)
+            hops.append(hop)
+            frontier = np.unique(hop[1])
+        alive = np.array([compound])
+        selected = []
+        for origins, neighbors, edges in reversed(hops):
+            mask = np.isin(neighbors, alive)
+            selected.append(edges[mask])
+            alive = np.unique(origins[mask])
+        if organism not in alive:
+            return []
+        edges = np.unique(np.concatenate(selected))[:max_edges]
+        return [self.relationship(edge) for edge in edges]
+
+    def path(self, edges):
+        return tuple(self.relationship(edge) for edge in edges)
+
+
+def metapath_relationship_types(metapath_query):
+    return METAPATH_RELATIONSHIP_PATTERN.findall(metapath_query)
+
+
+def load_local_graph(snapshot_dir):
+    # graph.npz caches the parsed CSVs. It is reused only while
+    # graph.manifest.json matches the size and mtime of both nodes.csv and
+    # edges.csv, or on its own when the snapshot ships without the CSVs.
+    npz_path = os.path.join(snapshot_dir, "graph.npz")
+    manifest_path = os.path.join(snapshot_dir, "graph.manifest.json")
+    nodes_path = os.path.join(snapshot_dir, "nodes.csv")
+    edges_path = os.path.join(snapshot_dir, "edges.csv")
+    if not (os.path.exists(nodes_path) and os.path.exists(edges_path)):
+        return LocalSpokeGraph.load(npz_path)
+    manifest = {"nodes": _source_manifest(nodes_path), "edges": _source_manifest(edges_path)}
+    if os.path.exists(npz_path) and _read_manifest(manifest_path) == manifest:
+        return LocalSpokeGraph.load(npz_path)
+    nodes = pd.read_csv(nodes_path, dtype={"identifier": str})
+    graph = local_graph_from_frames(nodes, pd.read_csv(edges_path))
+    try:
+        _atomic_write(npz_path, graph.save, "wb")
+        _atomic_write(manifest_path, lambda f: json.dump(manifest, f), "w")
+    except OSError:
+        pass
+    return graph
+
+
+def _read_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def local_graph_from_frames(nodes, edges):
+    node_index = pd.Series(np.arange(nodes.shape[0]), index=nodes["id"].values)
+    label_codes, label_names = pd.factorize(nodes["label"])
+    type_codes, type_names = pd.factorize(edges["type"])
+    return LocalSpokeGraph(
+        labels=label_codes,
+        label_names=label_names,
+        identifier=nodes["identifier"].fillna("").astype(str).values,
+        name=nodes.get("name", pd.Series("", index=nodes.index)).fillna("").astype(str).values,
+        description=nodes.get("description", pd.Series("", index=nodes.index)).fillna("").astype(str).values,
+        edge_src=node_index[edges["source"].values].values,
+        edge_dst=node_index[edges["target"].values].values,
+        edge_type=type_codes,
+        type_names=type_names,
+    )
+
+
+def _check_deadline(deadline):
+    if deadline is not None and time.monotonic() > deadline:
+        raise BudgetExceeded()
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Instrumentation is off unless BCMM_METRICS=1; when off, timed() returns the
+# function unchanged and span()/observe() return immediately.
+METRICS_ENABLED = os.environ.get("BCMM_METRICS") == "1"
+# Serves the Prometheus text format on /metrics when set.
+METRICS_PORT = os.environ.get("BCMM_METRICS_PORT")
+# Seconds between structured log lines on the "bcmm.metrics" logger; 0 disables them.
+METRICS_LOG_INTERVAL = float(os.environ.get("BCMM_METRICS_LOG_INTERVAL", 60))
+METRICS_PREFIX = "bcmm"
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 2000, 5000, 10000, 50000, float("inf"))
+
+logger = logging.getLogger("bcmm.metrics")
+
+_histograms = {}
+_counters = {}
+_metrics_lock = threading.Lock()
+_exporters_started = False
+
+
+class Histogram:
+    # Cumulative-bucket histogram in the Prometheus sense.
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        for count in self.counts:
+            total += count
+            yield total
+
+
+def observe(metric, value, buckets=SIZE_BUCKETS, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def increment(metric, amount=1, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+@contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        increment("span_errors_total", span=name)
+        raise
+    finally:
+        observe("span_seconds", time.perf_counter() - start, DURATION_BUCKETS, span=name)
+
+
+_NULL_SPAN = nullcontext()
+
+
+def span(name):
+    if not METRICS_ENABLED:
+        return _NULL_SPAN
+    return _span(name)
+
+
+def timed(name, on_result=None):
+    # Decorator form of span(); on_result(result) can record sizes of what
+    # the function returned (see record_size / record_graph).
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _span(name):
+                result = func(*args, **kwargs)
+            if on_result is not None:
+                on_result(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def record_size(metric, size=len, **labels):
+    return lambda result: observe(metric, size(result), **labels)
+
+
+def record_graph(builder, size):
+    # size(result) -> (number of nodes, number of edges)
+    def record(result):
+        n_nodes, n_edges = size(result)
+        observe("graph_nodes", n_nodes, builder=builder)
+        observe("graph_edges", n_edges, builder=builder)
+    return record
+
+
+def snapshot():
+    with _metrics_lock:
+        histograms = [
+            {"metric": metric, "labels": dict(labels), "count": histogram.count, "sum": histogram.sum,
+             "buckets": dict(zip(map(_format_bound, histogram.buckets), histogram.cumulative_counts()))}
+            for (metric, labels), histogram in _histograms.items()
+        ]
+        counters = [
+            {"metric": metric, "labels": dict(labels), "value": value}
+            for (metric, labels), value in _counters.items()
+        ]
+    return {"histograms": histograms, "counters": counters}
+
+
+def render_prometheus():
+    lines = []
+    current = snapshot()
+    for metric in sorted({entry["metric"] for entry in current["histograms"]}):
+        name = "{}_{}".format(METRICS_PREFIX, metric)
+        lines.append("# TYPE {} histogram".format(name))
+        for entry in current["histograms"]:
+            if entry["metric"] != metric:
+                continue
+            for bound, count in entry["buckets"].items():
+                lines.append("{}_bucket{} {}".format(name, _format_labels(entry["labels"], le=bound), count))
+            lines.append("{}_sum{} {}".format(name, _format_labels(entry["labels"]), entry["sum"]))
+            lines.append("{}_count{} {}".format(name, _format_labels(entry["labels"]), entry["count"]))
+    for metric in sorted({entry["metric"] for entry in current["counters"]}):
+        name = "{}_{}".format(METRICS_PREFIX, metric)
+        lines.append("# TYPE {} counter".format(name))
+        for entry in current["counters"]:
+            if entry["metric"] == metric:
+                lines.append("{}{} {}".format(name, _format_labels(entry["labels"]), entry["value"]))
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _metrics_lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _log_periodically(interval):
+    while True:
+        time.sleep(interval)
+        logger.info(json.dumps(dict(snapshot(), time=time.time())))
+
+
+def start_exporters():
+    # Once per process: Streamlit re-runs the page script but keeps imported
+    # modules, so calling this from module level starts the threads once.
+    global _exporters_started
+    with _metrics_lock:
+        if _exporters_started or not METRICS_ENABLED:
+            return
+        _exporters_started = True
+    if METRICS_PORT:
+        try:
+            server = ThreadingHTTPServer(("", int(METRICS_PORT)), _MetricsHandler)
+        except OSError as error:
+            logger.warning("metrics endpoint not started on port %s: %s", METRICS_PORT, error)
+        else:
+            threading.Thread(target=server.serve_forever, name="bcmm-metrics-http", daemon=True).start()
+    if METRICS_LOG_INTERVAL > 0:
+        threading.Thread(target=_log_periodically, args=(METRICS_LOG_INTERVAL,), name="bcmm-metrics-log", daemon=True).start()
+
+
+def _format_bound(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def _format_labels(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ""
+    escaped = ('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in items)
+    return "{" + ",".join(escaped) + "}"
+
+
+start_exporters()
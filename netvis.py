@@ -1,11 +1,27 @@
 import streamlit as st
 import streamlit.components.v1 as components
 from neo4j import GraphDatabase, basic_auth
+from neo4j.exceptions import DriverError, Neo4jError
 import networkx as nx
 from pyvis.network import Network
 import os
+import re
+import math
+import time
+import atexit
+import json
+import functools
+import pandas as pd
 import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
 from dotenv import load_dotenv
+from path_cache import PartialResult, cached_paths
+from spoke_records import relationships_from_maps
+from local_engine import LocalSpokeGraph, load_local_graph, metapath_relationship_types
+from graph_layout import cached_layout
+from metrics import record_graph, record_size, timed
 
 
 node_color_map = {
@@ -36,89 +52,252 @@ node_color_map = {
         "Symptom": "#fccde5"
     }
 
+VISJS_URL = "https://cdnjs.cloudflare.com/ajax/libs/vis-network/9.1.2/dist/vis-network.min.js"
+NETWORK_OPTIONS = {
+    "physics": {
+        "solver": "repulsion",
+        "repulsion": {
+            "nodeDistance": 250,
+            "centralGravity": 0.33,
+            "springLength": 110,
+            "springConstant": 0.1,
+            "damping": 100,
+        },
+    },
+}
+# Graphs with precomputed positions (see graph_layout.py) are drawn as-is.
+FIXED_LAYOUT_OPTIONS = {
+    "physics": {"enabled": False},
+    "edges": {"smooth": False},
+}
+VISJS_TEMPLATE = """<html>
+<head>
+<script type="text/javascript" src="%s"></script>
+<style type="text/css">#mynetwork {width: 100%%; height: 800px; border: 1px solid lightgray;}</style>
+</head>
+<body>
+<div id="mynetwork"></div>
+<script type="text/javascript">
+var nodes = new vis.DataSet(__NODES__);
+var edges = new vis.DataSet(__EDGES__);
+var network = new vis.Network(document.getElementById("mynetwork"), {nodes: nodes, edges: edges}, __OPTIONS__);
+</script>
+</body>
+</html>
+""" % VISJS_URL
+
 
 load_dotenv(os.path.join(os.path.expanduser("~"), ".neo4j_config.env"))
 URL = os.environ.get("SPOKE_URI")
 SPOKE_USER = os.environ.get("SPOKE_USER")
 SPOKE_PASSWORD = os.environ.get("SPOKE_PSW")
+SPOKE_MAX_POOL_SIZE = int(os.environ.get("SPOKE_MAX_POOL_SIZE", 50))
+SPOKE_LIVENESS_CHECK_TIMEOUT = float(os.environ.get("SPOKE_LIVENESS_CHECK_TIMEOUT", 30))
+SPOKE_CONNECTION_ACQUISITION_TIMEOUT = float(os.environ.get("SPOKE_CONNECTION_ACQUISITION_TIMEOUT", 60))
+SPOKE_QUERY_TIMEOUT = float(os.environ.get("SPOKE_QUERY_TIMEOUT", 30))
+SPOKE_METAPATH_WORKERS = int(os.environ.get("SPOKE_METAPATH_WORKERS", 8))
+SPOKE_PATH_MAX_HOPS = int(os.environ.get("SPOKE_PATH_MAX_HOPS", 6))
+SPOKE_PATH_ROW_BUDGET = int(os.environ.get("SPOKE_PATH_ROW_BUDGET", 20))
+SPOKE_PATH_TIMEOUT = float(os.environ.get("SPOKE_PATH_TIMEOUT", 15))
+SPOKE_MAX_GRAPH_NODES = int(os.environ.get("SPOKE_MAX_GRAPH_NODES", 2000))
+SPOKE_MAX_GRAPH_EDGES = int(os.environ.get("SPOKE_MAX_GRAPH_EDGES", 5000))
+# Graphs with at least this many nodes are laid out server-side instead of by
+# the browser's physics simulation.
+SPOKE_SERVER_LAYOUT_MIN_NODES = int(os.environ.get("SPOKE_SERVER_LAYOUT_MIN_NODES", 200))
+# "local" answers path queries from an exported subgraph (see local_engine.py)
+# instead of the live Neo4j server.
+SPOKE_BACKEND = os.environ.get("SPOKE_BACKEND", "neo4j")
+SPOKE_LOCAL_SNAPSHOT = os.environ.get("SPOKE_LOCAL_SNAPSHOT", "data/spoke_snapshot")
+# Offline mode serves network views from the path cache only (see path_cache.py).
+SPOKE_OFFLINE = os.environ.get("SPOKE_OFFLINE") == "1"
+# Built network views (vis.js payload, legend, options) kept per process.
+SPOKE_VIEW_CACHE_SIZE = int(os.environ.get("SPOKE_VIEW_CACHE_SIZE", 64))
+
+_driver = None
+_driver_lock = threading.Lock()
+_metapath_executor = ThreadPoolExecutor(max_workers=SPOKE_METAPATH_WORKERS, thread_name_prefix="spoke-metapath")
+_view_cache = OrderedDict()
+_view_cache_lock = threading.Lock()
 
 def connect_to_neo4j():
-    return GraphDatabase.driver(URL, auth=basic_auth(SPOKE_USER, SPOKE_PASSWORD))  
+    return GraphDatabase.driver(
+        URL,
+        auth=basic_auth(SPOKE_USER, SPOKE_PASSWORD),
+        max_connection_pool_size=SPOKE_MAX_POOL_SIZE,
+        liveness_check_timeout=SPOKE_LIVENESS_CHECK_TIMEOUT,
+        connection_acquisition_timeout=SPOKE_CONNECTION_ACQUISITION_TIMEOUT,
+    )
 
-def fetch_shortest_path(driver, source, target):
+def get_driver():
+    # One pooled driver per server process; every Streamlit session borrows
+    # connections from it through driver.session().
+    global _driver
+    if _driver is None and not SPOKE_OFFLINE:
+        with _driver_lock:
+            if _driver is None:
+                _driver = load_local_graph(SPOKE_LOCAL_SNAPSHOT) if SPOKE_BACKEND == "local" else connect_to_neo4j()
+    return _driver
+
+def set_driver(driver):
+    global _driver
+    with _driver_lock:
+        _driver = driver
+
+def close_driver():
+    global _driver
+    with _driver_lock:
+        if _driver is not None:
+            _driver.close()
+            _driver = None
+
+atexit.register(close_driver)
+
+def run_budgeted_query(driver, cypher, timeout, **parameters):
+    # Runs cypher under a server-side transaction timeout. If the budget runs
+    # out mid-stream the rows received so far are kept, flagged as partial.
+    rows = PartialResult()
     with driver.session() as session:
-        result = session.run(
-            """            
-            MATCH (o:Organism {identifier: $source}), (c:Compound {identifier: $target})
-            MATCH path = allShortestPaths((c)-[*]-(o))
-            RETURN path
-            """,
-            source=source,
-            target=target,
-        )
-        paths = []
-        for row in result:
-            paths.append(row["path"])
-        return paths
+        try:
+            with session.begin_transaction(timeout=timeout) as tx:
+                for row in tx.run(cypher, **parameters):
+                    rows.append(row)
+        except Neo4jError as error:
+            if "TimedOut" not in (error.code or ""):
+                raise
+            return rows
+    return list(rows)
+
+def _fetch_shortest_path(driver, source, target, timeout):
+    rows = run_budgeted_query(
+        driver,
+        """
+        MATCH (o:Organism {identifier: $source}), (c:Compound {identifier: $target})
+        MATCH path = allShortestPaths((c)-[*..%d]-(o))
+        RETURN path LIMIT $row_budget
+        """ % SPOKE_PATH_MAX_HOPS,
+        timeout,
+        source=source,
+        target=target,
+        row_budget=SPOKE_PATH_ROW_BUDGET,
+    )
+    paths = [row["path"] for row in rows]
+    return PartialResult(paths) if isinstance(rows, PartialResult) else paths
+
+@timed("netvis.fetch_shortest_path", on_result=record_size("spoke_records", query="fetch_shortest_path"))
+@cached_paths("fetch_shortest_path")
+def fetch_shortest_path(driver, source, target):
+    if isinstance(driver, LocalSpokeGraph):
+        return driver.fetch_shortest_path(source, target, SPOKE_PATH_MAX_HOPS, SPOKE_PATH_ROW_BUDGET, SPOKE_PATH_TIMEOUT)
+    return _fetch_shortest_path(driver, source, target, SPOKE_PATH_TIMEOUT)
 
+@timed("netvis.fetch_path", on_result=record_size("spoke_records", query="fetch_path"))
+@cached_paths("fetch_path")
 def fetch_path(driver, source, target):
-    with driver.session() as session:
-        result = session.run(
-            """            
-            MATCH (o:Organism {identifier: $source}), (c:Compound {identifier: $target})
-            MATCH path1 = (o)-[:ENCODES_OeP]->(p:Protein)-[:HAS_PhEC]->(e:EC)-[:ISA_ECiEC]->(e2:EC)-[*1..2]->(r:Reaction)
-            MATCH path2 = allShortestPaths((r)-[*]-(c))            
-            RETURN path1, path2 LIMIT 10
-            """,
-            source=source,
-            target=target,
-        )
-        paths = []
-        for row in result:
-            paths.append(row["path1"])
-            paths.append(row["path2"])
-        result = session.run(
-            """            
-            MATCH (o:Organism {identifier: $source}), (c:Compound {name: $target})
-            MATCH path1 = (o)-[:ENCODES_OeP]->(p:Protein)-[:HAS_PhEC]->(e:EC)-[*1..2]->(r:Reaction)
-            MATCH path2 = allShortestPaths((r)-[*]-(c))            
-            RETURN path1, path2 LIMIT 10
-            """,
-            source=source,
-            target=target,
-        )        
-        for row in result:
-            paths.append(row["path1"])
-            paths.append(row["path2"])
-        if len(paths) == 0:
-            paths = fetch_shortest_path(driver, source, target)
-        return paths
+    # Both Organism -> Protein -> EC -> Reaction patterns run as one UNION
+    # subquery; the Reaction -> Compound leg and the fallback are hop-bounded,
+    # and the whole call shares one SPOKE_PATH_TIMEOUT budget.
+    if isinstance(driver, LocalSpokeGraph):
+        return driver.fetch_path(source, target, SPOKE_PATH_MAX_HOPS, SPOKE_PATH_ROW_BUDGET, SPOKE_PATH_TIMEOUT)
+    deadline = time.monotonic() + SPOKE_PATH_TIMEOUT
+    rows = run_budgeted_query(
+        driver,
+        """
+        MATCH (o:Organism {identifier: $source}), (c:Compound {identifier: $target})
+        CALL {
+            WITH o
+            MATCH path1 = (o)-[:ENCODES_OeP]->(:Protein)-[:HAS_PhEC]->(:EC)-[:ISA_ECiEC]->(:EC)-[*1..2]->(r:Reaction)
+            RETURN path1, r
+            UNION
+            WITH o
+            MATCH path1 = (o)-[:ENCODES_OeP]->(:Protein)-[:HAS_PhEC]->(:EC)-[*1..2]->(r:Reaction)
+            RETURN path1, r
+        }
+        MATCH path2 = allShortestPaths((r)-[*..%d]-(c))
+        RETURN path1, path2 LIMIT $row_budget
+        """ % SPOKE_PATH_MAX_HOPS,
+        SPOKE_PATH_TIMEOUT,
+        source=source,
+        target=target,
+        row_budget=SPOKE_PATH_ROW_BUDGET,
+    )
+    paths = []
+    for row in rows:
+        paths.append(row["path1"])
+        paths.append(row["path2"])
+    if isinstance(rows, PartialResult):
+        return PartialResult(paths)
+    if len(paths) == 0:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return PartialResult()
+        return _fetch_shortest_path(driver, source, target, remaining)
+    return paths
     
     
     
-def fetch_path_from_metapath(driver, source_node, target_node, metapath_data):
-    nhop = metapath_data['nhops']
-    column_names = [f"col_{i}" for i in range(1, nhop+1)]
-    place_holder_values = (source_node,) + tuple(metapath_data[col] for col in column_names) + (target_node,)    
-    cypher = 'MATCH path=(o:Organism{identifier:%s})-[:%s]->(n1)'
-    for i in range(nhop-2):
-        cypher += '-[:%s]-(n{})'.format(i+2)
-    cypher += '-[:%s]-(c:Compound{identifier:"%s"})'
-    cypher += ' UNWIND nodes(path) AS n'
-    cypher += ' UNWIND relationships(path) AS r'
-    cypher += ' RETURN n, r'
-    cypher = cypher%(place_holder_values)
+RELATIONSHIP_TYPE_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# Distinct relationships (capped at $max_edges) and the distinct nodes they
+# touch, collected server-side into one row of ID-keyed maps.
+METAPATH_RETURN_CLAUSE = """
+UNWIND relationships(path) AS r
+WITH DISTINCT r LIMIT $max_edges
+WITH collect(r) AS rels
+UNWIND rels AS r
+UNWIND [startNode(r), endNode(r)] AS n
+WITH rels, collect(DISTINCT n) AS nodes
+RETURN [n IN nodes | {id: id(n), labels: labels(n), name: n.name, description: n.description, identifier: n.identifier}] AS nodes,
+       [r IN rels | {id: id(r), type: type(r), start: id(startNode(r)), end: id(endNode(r))}] AS rels
+"""
+
+def compile_metapath_query(metapath_data):
+    # Relationship types are baked into the text; the organism and compound
+    # identifiers are $parameters, so Neo4j caches one plan per metapath.
+    nhop = int(metapath_data['nhops'])
+    relationship_types = [metapath_data[f"col_{i}"] for i in range(1, nhop+1)]
+    for relationship_type in relationship_types:
+        if not isinstance(relationship_type, str) or not RELATIONSHIP_TYPE_PATTERN.match(relationship_type):
+            raise ValueError(f"Invalid relationship type in metapath: {relationship_type!r}")
+    cypher = 'MATCH path=(o:Organism {identifier: $source})-[:%s]->(n1)' % relationship_types[0]
+    for i, relationship_type in enumerate(relationship_types[1:-1]):
+        cypher += '-[:%s]-(n%d)' % (relationship_type, i+2)
+    cypher += '-[:%s]-(c:Compound {identifier: $target})' % relationship_types[-1]
+    cypher += METAPATH_RETURN_CLAUSE
+    return cypher
+
+def compile_metapath_queries(metapath_data):
+    return [compile_metapath_query(row) for index, row in metapath_data.iterrows()]
+
+@functools.lru_cache(maxsize=None)
+def load_metapath_queries(metapath_path):
+    return tuple(compile_metapath_queries(pd.read_csv(metapath_path)))
+
+@timed("netvis.fetch_path_from_metapath", on_result=record_size("spoke_records", query="fetch_path_from_metapath"))
+@cached_paths("fetch_path_from_metapath")
+def fetch_path_from_metapath(driver, source_node, target_node, metapath_query):
+    if isinstance(driver, LocalSpokeGraph):
+        return driver.fetch_path_from_metapath(source_node, target_node, metapath_relationship_types(metapath_query), SPOKE_MAX_GRAPH_EDGES)
     with driver.session() as session:
-        with session.begin_transaction() as tx:
-            result = tx.run(cypher)
-            path_list = []
-            for row in result:
-                path_list.append((row['n'], row['r']))
-    return path_list
+        with session.begin_transaction(timeout=SPOKE_QUERY_TIMEOUT) as tx:
+            result = tx.run(metapath_query, source=source_node, target=target_node, max_edges=SPOKE_MAX_GRAPH_EDGES)
+            row = result.single()
+    if row is None:
+        return []
+    return relationships_from_maps(row['nodes'], row['rels'])
 
 
     
     
+def _nx_graph_size(graph):
+    return graph.number_of_nodes(), graph.number_of_edges()
+
+def _pyvis_graph_size(result):
+    net, legend_color_map = result
+    return len(net.nodes), len(net.edges)
+
+def _visjs_payload_size(result):
+    payload, legend_color_map = result
+    return len(payload["nodes"]), len(payload["edges"])
+
 def create_legend(legend_color_map):
     legend_html = """
     <div style="border: 2px solid #ccc; padding: 10px; background-color: #f9f9f9;">
@@ -141,6 +320,7 @@ def create_legend(legend_color_map):
 
     return legend_html
 
+@timed("netvis.create_nx_graph", on_result=record_graph("create_nx_graph", _nx_graph_size))
 def create_nx_graph(paths):
     graph = nx.DiGraph()
     for path in paths:
@@ -157,30 +337,41 @@ def create_nx_graph(paths):
             graph.add_edge(sub_obj[0], sub_obj[1], edgetype=record.type)
     return graph
 
-def create_nx_graph_v2(paths):
+@timed("netvis.create_nx_graph_v2", on_result=record_graph("create_nx_graph_v2", _nx_graph_size))
+def create_nx_graph_v2(paths, max_nodes=SPOKE_MAX_GRAPH_NODES, max_edges=SPOKE_MAX_GRAPH_EDGES):
+    # paths: one iterable of distinct relationships per metapath query.
+    # Relationships are consumed one at a time; anything past the node or
+    # edge cap is dropped so pathological pairs cannot exhaust memory.
     graph = nx.DiGraph()
+    seen = set()
     for path in paths:
-        path = list(map(lambda x:x[-1], path))
-        path = list(set(path))
-        for record in path:            
+        for record in path:
+            if record in seen:
+                continue
+            seen.add(record)
+            if graph.number_of_edges() >= max_edges:
+                return graph
             sub_obj = []
             for node in record.nodes:
                 node_label = list(node.labels)[0]
                 try:
                     if node_label != 'Protein':
-                        graph.add_node(node["name"], nodetype=node_label)
-                        sub_obj.append(node["name"])
+                        sub_obj.append((node["name"], node_label))
                     else:
-                        graph.add_node(node["description"], nodetype=node_label)
-                        sub_obj.append(node["description"])
+                        sub_obj.append((node["description"], node_label))
                 except:
-                    graph.add_node(node["identifier"], nodetype=node_label)
-                    sub_obj.append(node["identifier"])
-            graph.add_edge(sub_obj[0], sub_obj[1], edgetype=record.type)
+                    sub_obj.append((node["identifier"], node_label))
+            new_nodes = len({name for name, node_label in sub_obj if name not in graph})
+            if graph.number_of_nodes() + new_nodes > max_nodes:
+                continue
+            for name, node_label in sub_obj:
+                graph.add_node(name, nodetype=node_label)
+            graph.add_edge(sub_obj[0][0], sub_obj[1][0], edgetype=record.type)
     return graph
 
 
 
+@timed("netvis.create_pyvis_graph", on_result=record_graph("create_pyvis_graph", _pyvis_graph_size))
 def create_pyvis_graph(graph):
     net = Network(width="100%", height="800px", notebook=True)
     net.from_nx(graph)
@@ -206,6 +397,77 @@ def create_pyvis_graph(graph):
                    )
     return net, legend_color_map
 
+def _node_name(node):
+    try:
+        return node["name"]
+    except:
+        return node["identifier"]
+
+def _node_name_v2(node):
+    try:
+        if list(node.labels)[0] != 'Protein':
+            return node["name"]
+        return node["description"]
+    except:
+        return node["identifier"]
+
+@timed("netvis.create_visjs_payload", on_result=record_graph("create_visjs_payload", _visjs_payload_size))
+def create_visjs_payload(paths, node_name=_node_name, max_nodes=SPOKE_MAX_GRAPH_NODES, max_edges=SPOKE_MAX_GRAPH_EDGES):
+    # Builds the vis.js nodes/edges lists straight from the path records in
+    # one pass, with the same node naming, colouring and caps as the
+    # networkx -> pyvis route.
+    nodes = {}
+    edges = {}
+    legend_color_map = {}
+    seen = set()
+    for path in paths:
+        for record in path:
+            if record in seen:
+                continue
+            seen.add(record)
+            if len(edges) >= max_edges:
+                break
+            ends = [(node_name(node), list(node.labels)[0]) for node in record.nodes]
+            if len(nodes) + len({name for name, nodetype in ends if name not in nodes}) > max_nodes:
+                continue
+            for name, nodetype in ends:
+                if name not in nodes:
+                    color = node_color_map[nodetype]
+                    nodes[name] = {"id": name, "label": str(name), "shape": "dot", "size": 10, "color": color, "nodetype": nodetype}
+                    legend_color_map[nodetype] = color
+            source_node, target_node = ends[0][0], ends[1][0]
+            edges[source_node, target_node] = {"from": source_node, "to": target_node, "arrows": "to", "title": f"Edge Type: {record.type}"}
+    return {"nodes": list(nodes.values()), "edges": list(edges.values())}, legend_color_map
+
+def render_visjs_html(payload, options=NETWORK_OPTIONS):
+    def to_script_json(value):
+        return json.dumps(value, default=str).replace("</", "<\\/")
+    return (VISJS_TEMPLATE
+            .replace("__NODES__", to_script_json(payload["nodes"]))
+            .replace("__EDGES__", to_script_json(payload["edges"]))
+            .replace("__OPTIONS__", to_script_json(options)))
+
+@timed("netvis.layout_visjs_payload")
+def layout_visjs_payload(payload, view_key, min_nodes=SPOKE_SERVER_LAYOUT_MIN_NODES):
+    # Pins large graphs to cached server-side positions and returns the
+    # vis.js options to render them with; small graphs keep browser physics.
+    if len(payload["nodes"]) < min_nodes:
+        return NETWORK_OPTIONS
+    positions = cached_layout(
+        view_key,
+        [node["id"] for node in payload["nodes"]],
+        [node["nodetype"] for node in payload["nodes"]],
+        [(edge["from"], edge["to"]) for edge in payload["edges"]],
+    )
+    for node in payload["nodes"]:
+        node["x"], node["y"] = positions[node["id"]]
+    return FIXED_LAYOUT_OPTIONS
+
+@timed("netvis.show_visjs_network")
+def show_visjs_network(payload, legend_color_map, options=NETWORK_OPTIONS):
+    components.html(create_legend(legend_color_map) + render_visjs_html(payload, options), height=1000, width=1000)
+
+@timed("netvis.show_network")
 def show_network(net, legend_color_map):                               
     with tempfile.NamedTemporaryFile(delete=False, suffix=".html") as temp_html_file:
         temp_html_filename = temp_html_file.name
@@ -216,30 +478,122 @@ def show_network(net, legend_color_map):
     os.unlink(temp_html_filename)
 
     
+def cached_view(key):
+    with _view_cache_lock:
+        view = _view_cache.get(key)
+        if view is not None:
+            _view_cache.move_to_end(key)
+        return view
+
+def store_view(key, view):
+    with _view_cache_lock:
+        _view_cache[key] = view
+        while len(_view_cache) > SPOKE_VIEW_CACHE_SIZE:
+            _view_cache.popitem(last=False)
+
+def path_view(organism_id, compound_id):
+    # (payload, legend_color_map, options) for network_vis. Views built from
+    # complete results are kept, so a view the prefetcher (prefetch.py)
+    # built is shown without touching SPOKE.
+    key = ("path", str(organism_id).strip(), compound_id)
+    view = cached_view(key)
+    if view is None:
+        paths = fetch_path(get_driver(), int(organism_id), compound_id)
+        payload, legend_color_map = create_visjs_payload(paths)
+        view = (payload, legend_color_map, layout_visjs_payload(payload, key))
+        if not isinstance(paths, PartialResult):
+            store_view(key, view)
+    return view
+
+def metapath_view(organism_id, compound_id, metapath_queries, on_progress=None, executor=_metapath_executor):
+    # (view, failed query count) for metapath_based_network_vis; view is None
+    # when no metapath matched. on_progress(view) is called from this thread
+    # whenever another query's relationships arrive. With executor=None the
+    # queries run one after another in this thread instead of on the shared
+    # pool, as the prefetcher does (see prefetch_metapath_view).
+    organism_id = str(organism_id).strip()
+    key = ("metapath", organism_id, compound_id, metapath_queries)
+    view = cached_view(key)
+    if view is not None:
+        return view, 0
+    driver = get_driver()
+    paths = []
+    failed = 0
+    view = (None, None, None)
+
+    def collect(fetch):
+        nonlocal failed, view
+        try:
+            path = fetch()
+        except (DriverError, Neo4jError):
+            failed += 1
+            return
+        if not path:
+            return
+        paths.append(path)
+        payload, legend_color_map = create_visjs_payload(paths, node_name=_node_name_v2)
+        view = (payload, legend_color_map, layout_visjs_payload(payload, ("metapath", organism_id, compound_id)))
+        if on_progress is not None:
+            on_progress(view)
+
+    if executor is None:
+        # Each query is bounded server-side by SPOKE_QUERY_TIMEOUT.
+        for metapath_query in metapath_queries:
+            collect(lambda: fetch_path_from_metapath(driver, int(organism_id), compound_id, metapath_query))
+    else:
+        futures = [
+            executor.submit(fetch_path_from_metapath, driver, int(organism_id), compound_id, metapath_query)
+            for metapath_query in metapath_queries
+        ]
+        # Each query is bounded server-side by SPOKE_QUERY_TIMEOUT; the
+        # overall wait allows for queries queued behind the worker pool.
+        waves = math.ceil(len(futures) / SPOKE_METAPATH_WORKERS)
+        try:
+            for future in as_completed(futures, timeout=SPOKE_QUERY_TIMEOUT * waves):
+                collect(future.result)
+        except TimeoutError:
+            failed += sum(not future.done() for future in futures)
+            for future in futures:
+                future.cancel()
+    if not failed and not any(isinstance(path, PartialResult) for path in paths):
+        store_view(key, view)
+    return view, failed
+
+def prefetch_metapath_view(organism_id, compound_id, metapath_queries):
+    # Prefetch task: queries run in the prefetch worker's own thread, so
+    # background warming never queues ahead of foreground renders on
+    # _metapath_executor.
+    return metapath_view(organism_id, compound_id, metapath_queries, executor=None)
+
+@timed("netvis.network_vis")
 def network_vis(organism_id, compound_id):
     if organism_id and compound_id: 
         with st.spinner("Connecting to SPOKE ..."):
-            driver = connect_to_neo4j()
-            paths = fetch_path(driver, int(organism_id), compound_id)
-            driver.close()
-            graph = create_nx_graph(paths)
-            net, legend_color_map = create_pyvis_graph(graph)
-            show_network(net, legend_color_map)
-
-def metapath_based_network_vis(organism_id, compound_id, metapath_data):
+            payload, legend_color_map, options = path_view(organism_id, compound_id)
+            show_visjs_network(payload, legend_color_map, options)
+
+@timed("netvis.metapath_based_network_vis")
+def metapath_based_network_vis(organism_id, compound_id, metapath_queries):
     if organism_id and compound_id: 
         with st.spinner("Connecting to SPOKE ..."):
-            driver = connect_to_neo4j()
-            paths = []
-            for index, row in metapath_data.iterrows():
-                paths.append(fetch_path_from_metapath(driver, int(organism_id), compound_id, row))
-            driver.close()
-            graph = create_nx_graph_v2(paths)
-            net, legend_color_map = create_pyvis_graph(graph)
-            show_network(net, legend_color_map)
+            network_placeholder = st.empty()
+            shown = []
+
+            def show(view):
+                shown.append(view)
+                with network_placeholder.container():
+                    show_visjs_network(*view)
+
+            view, failed = metapath_view(organism_id, compound_id, metapath_queries, on_progress=show)
+            if view[0] is not None and not shown:
+                show(view)
+            if failed:
+                st.warning("{} of {} metapath queries failed or timed out; showing partial results".format(failed, len(metapath_queries)))
             
             
 def print_vpn_warning():
+    if SPOKE_BACKEND == "local":
+        return
     st.markdown(
     '<div style="color: red;">IMPORTANT : Make sure you are connected to UCSF VPN to explore the network</div>',
     unsafe_allow_html=True
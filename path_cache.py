@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import functools
+import threading
+from spoke_records import dump_records, load_records
+
+
+SPOKE_PATH_CACHE_PATH = os.environ.get("SPOKE_PATH_CACHE_PATH", "data/cache/spoke_paths.sqlite")
+SPOKE_PATH_CACHE_MAX_BYTES = int(os.environ.get("SPOKE_PATH_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+SPOKE_PATH_CACHE_TTL = float(os.environ.get("SPOKE_PATH_CACHE_TTL", 7 * 24 * 3600))
+# Bump when SPOKE is reloaded; entries recorded against another snapshot are dropped.
+SPOKE_SNAPSHOT = os.environ.get("SPOKE_SNAPSHOT", "default")
+SPOKE_PATH_FIXTURE = os.environ.get("SPOKE_PATH_FIXTURE")
+PATH_CACHE_FORMAT_VERSION = 2
+
+_path_cache = None
+_path_cache_lock = threading.Lock()
+
+
+class PartialResult(list):
+    # Records cut short by a query budget; served but never cached.
+    pass
+
+
+class PathCache:
+    def __init__(self, path, max_bytes=SPOKE_PATH_CACHE_MAX_BYTES, ttl=SPOKE_PATH_CACHE_TTL, snapshot=SPOKE_SNAPSHOT):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = "{}:{}".format(PATH_CACHE_FORMAT_VERSION, snapshot)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS paths ("
+            "key TEXT PRIMARY KEY, version TEXT, created REAL, accessed REAL, size INTEGER, value BLOB)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS paths_accessed ON paths (accessed)")
+        self._conn.execute("DELETE FROM paths WHERE version != ?", (self.version,))
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT created, value FROM paths WHERE key = ? AND version = ?",
+                (key, self.version),
+            ).fetchone()
+            if row is None:
+                return None
+            created, value = row
+            if now - created > self.ttl:
+                self._conn.execute("DELETE FROM paths WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE paths SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(value))
+
+    def put(self, key, payload):
+        value = zlib.compress(json.dumps(payload, separators=(",", ":")).encode())
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO paths (key, version, created, accessed, size, value) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, self.version, now, now, len(value), value),
+            )
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM paths").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM paths ORDER BY accessed").fetchall():
+            if total - evicted <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM paths WHERE key = ?", (key,))
+            evicted += size
+
+    def import_fixture(self, fixture_path):
+        with open(fixture_path) as f:
+            fixture = json.load(f)
+        for entry in fixture["entries"]:
+            self.put(entry["key"], entry["value"])
+
+    def export_fixture(self, fixture_path):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM paths WHERE version = ?", (self.version,)).fetchall()
+        entries = [{"key": key, "value": json.loads(zlib.decompress(value))} for key, value in rows]
+        with open(fixture_path, "w") as f:
+            json.dump({"version": self.version, "entries": entries}, f)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def get_path_cache():
+    global _path_cache
+    if _path_cache is None and SPOKE_PATH_CACHE_PATH:
+        with _path_cache_lock:
+            if _path_cache is None:
+                _path_cache = PathCache(SPOKE_PATH_CACHE_PATH)
+                if SPOKE_PATH_FIXTURE:
+                    _path_cache.import_fixture(SPOKE_PATH_FIXTURE)
+    return _path_cache
+
+
+def set_path_cache(cache):
+    global _path_cache
+    with _path_cache_lock:
+        _path_cache = cache
+
+
+def cache_key(kind, *args):
+    return json.dumps([kind] + [_key_part(arg) for arg in args], default=str)
+
+
+def cached_paths(kind):
+    # Wraps a fetch_*(driver, *args) function. Hits are served as SpokeNode /
+    # SpokeRelationship records; with driver=None (offline) a miss yields [].
+    def decorate(fetch):
+        @functools.wraps(fetch)
+        def wrapper(driver, *args):
+            cache = get_path_cache()
+            if cache is None:
+                return fetch(driver, *args) if driver is not None else []
+            key = cache_key(kind, *args)
+            payload = cache.get(key)
+            if payload is not None:
+                return load_records(payload)
+            if driver is None:
+                return []
+            records = fetch(driver, *args)
+            if not isinstance(records, PartialResult):
+                cache.put(key, dump_records(records))
+            return records
+        return wrapper
+    return decorate
+
+
+def _key_part(arg):
+    if hasattr(arg, "tolist"):
+        return arg.tolist()
+    return arg
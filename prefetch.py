@@ -0,0 +1,80 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from metrics import increment
+
+
+# Opt-in warming of the network views (netvis.path_view /
+# prefetch_metapath_view) of the top-ranked bacteria of the selected compound,
+# so the view for the NCBI ID a user is likely to enter next is already
+# built. Tasks do their SPOKE queries in the prefetch worker's thread and
+# never submit to the pools foreground renders wait on.
+PREFETCH_TOP_N = int(os.environ.get("BCMM_PREFETCH_TOP_N", 5))
+# Shared by every session of the server process.
+PREFETCH_WORKERS = int(os.environ.get("BCMM_PREFETCH_WORKERS", 4))
+# Tasks one session may have on the shared pool at once.
+PREFETCH_PER_SESSION = int(os.environ.get("BCMM_PREFETCH_PER_SESSION", 2))
+
+logger = logging.getLogger("bcmm.prefetch")
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="spoke-prefetch")
+
+
+class Prefetcher:
+    # One per browser session. Every prefetch() with a new key starts a new
+    # generation: tasks of older generations still queued are dropped, and
+    # ones already handed to the pool return without running. A task that
+    # is already running finishes, since its result only fills the caches.
+    def __init__(self, executor=_prefetch_executor, max_running=PREFETCH_PER_SESSION):
+        self.executor = executor
+        self.max_running = max_running
+        self.key = None
+        self.generation = 0
+        self.pending = deque()
+        self.running = 0
+        self.lock = threading.Lock()
+
+    def prefetch(self, key, tasks):
+        # tasks: (func, args) pairs. Streamlit reruns the page on every
+        # widget change, so a call with the current key is a no-op.
+        with self.lock:
+            if key == self.key:
+                return
+            self.key = key
+            self.generation += 1
+            self.pending = deque((self.generation, func, args) for func, args in tasks)
+        self._submit_pending()
+
+    def cancel(self):
+        self.prefetch(None, [])
+
+    def _submit_pending(self):
+        with self.lock:
+            while self.pending and self.running < self.max_running:
+                generation, func, args = self.pending.popleft()
+                self.running += 1
+                self.executor.submit(self._run, generation, func, args)
+
+    def _run(self, generation, func, args):
+        try:
+            if generation != self.generation:
+                increment("prefetch_tasks_total", outcome="cancelled")
+                return
+            func(*args)
+            increment("prefetch_tasks_total", outcome="done")
+        except Exception:
+            increment("prefetch_tasks_total", outcome="failed")
+            logger.warning("prefetch of %s%r failed", getattr(func, "__name__", func), args, exc_info=True)
+        finally:
+            with self.lock:
+                self.running -= 1
+            self._submit_pending()
+
+
+def session_prefetcher():
+    if "prefetcher" not in st.session_state:
+        st.session_state["prefetcher"] = Prefetcher()
+    return st.session_state["prefetcher"]
@@ -0,0 +1,138 @@
+import threading
+import numpy as np
+import pandas as pd
+from data_store import FEATURES
+from metrics import timed
+
+
+# sort key -> ascending
+BCMM_SORT_KEYS = {
+    "embedding": False,
+    "shortest_path_length": True,
+    "p_value": True,
+}
+
+SIGNIFICANCE_LEVEL = 0.05
+
+_rank_indexes = {}
+_rank_indexes_lock = threading.Lock()
+
+
+class RankIndex:
+    # One permutation per (sort key, compound row): order[key][row] lists the
+    # bacteria from best to worst, so a top-k table is a slice plus a gather.
+    def __init__(self, order):
+        self.order = order
+
+    def top_k(self, row, sort_key, k):
+        return self.order[sort_key][row, :k]
+
+
+def rank_rows(matrix, ascending):
+    values = np.asarray(matrix)
+    if not ascending:
+        values = -values
+    order = np.argsort(values, axis=1, kind="stable").astype(np.int32)
+    order.setflags(write=False)
+    return order
+
+
+@timed("ranking.build_rank_index")
+def build_rank_index(matrices):
+    return RankIndex({
+        sort_key: rank_rows(matrix, ascending)
+        for sort_key, (matrix, ascending) in matrices.items()
+    })
+
+
+def build_dwpc_rank_index(store):
+    return build_rank_index({"dwpc": (store.by_compound, False)})
+
+
+def build_bcmm_rank_index(store):
+    return build_rank_index({
+        sort_key: (getattr(store, sort_key), ascending)
+        for sort_key, ascending in BCMM_SORT_KEYS.items()
+    })
+
+
+def get_rank_index(name, builder):
+    index = _rank_indexes.get(name)
+    if index is None:
+        with _rank_indexes_lock:
+            index = _rank_indexes.get(name)
+            if index is None:
+                index = _rank_indexes[name] = builder()
+    return index
+
+
+def ranked_bacteria_table(store, rank_index, compound_name, sort_key, bacteria_count, features=FEATURES):
+    row = store.compound_index[compound_name]
+    order = _top_k_order(rank_index, getattr(store, sort_key), row, sort_key, BCMM_SORT_KEYS[sort_key], bacteria_count)
+    table = {"ncbi_id": store.ncbi_id[order], "name": store.name[order]}
+    for feature in features:
+        table[feature] = getattr(store, feature)[row, order]
+    return pd.DataFrame(table)
+
+
+def ranked_dwpc_table(store, rank_index, cmp_index, bacteria_count):
+    order = _top_k_order(rank_index, store.by_compound, cmp_index, "dwpc", False, bacteria_count)
+    return pd.DataFrame({
+        "spoke_id": store.spoke_id[order],
+        "spoke_name": store.spoke_name[order],
+        "dwpc": store.column(cmp_index)[order],
+    })
+
+
+def _top_k_order(rank_index, matrix, row, sort_key, ascending, k):
+    if rank_index is not None:
+        return rank_index.top_k(row, sort_key, k)
+    # Without an index only this row is ranked, in the order the index would give.
+    return rank_rows(matrix[row:row + 1], ascending)[0, :k]
+
+
+def top_k_positions(values, k, ascending):
+    values = np.asarray(values)
+    if not ascending:
+        values = -values
+    k = min(k, values.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(values, k - 1)[:k]
+    return top[np.argsort(values[top], kind="stable")]
+
+
+def ranked_compound_table(store, ncbi_id, sort_key, compound_count, compound_rows=None, features=FEATURES):
+    values = store.bacterium(ncbi_id)
+    if compound_rows is None:
+        compound_rows = np.arange(len(store.compound_names))
+    compound_rows = np.asarray(compound_rows)
+    order = compound_rows[top_k_positions(values[sort_key][compound_rows], compound_count, BCMM_SORT_KEYS[sort_key])]
+    table = {"compound": np.asarray(store.compound_names, dtype=object)[order]}
+    for feature in features:
+        table[feature] = values[feature][order]
+    return pd.DataFrame(table)
+
+
+def compound_rows(store, compound_names):
+    return np.fromiter((store.compound_index[cmp_name] for cmp_name in compound_names), dtype=np.intp)
+
+
+def compare_compounds_table(store, compound_names, bacteria_count, rank_by, aggregates=("mean_embedding", "max_embedding", "significant_count")):
+    # One gather of the selected rows into a stacked compounds x bacteria
+    # matrix, then column-wise reductions; no per-compound tables or sorts.
+    rows = compound_rows(store, compound_names)
+    aggregated = {}
+    if "mean_embedding" in aggregates or "max_embedding" in aggregates:
+        embedding = store.embedding[rows]
+        if "mean_embedding" in aggregates:
+            aggregated["mean_embedding"] = embedding.mean(axis=0)
+        if "max_embedding" in aggregates:
+            aggregated["max_embedding"] = embedding.max(axis=0)
+    if "significant_count" in aggregates:
+        aggregated["significant_count"] = np.count_nonzero(store.p_value[rows] < SIGNIFICANCE_LEVEL, axis=0)
+    order = top_k_positions(aggregated[rank_by], bacteria_count, ascending=False)
+    table = {"ncbi_id": store.ncbi_id[order], "name": store.name[order]}
+    for aggregate in aggregates:
+        table[aggregate] = aggregated[aggregate][order]
+    return pd.DataFrame(table)
@@ -0,0 +1,142 @@
+NODE_PROPERTIES = ["name", "description", "identifier"]
+
+
+class SpokeNode:
+    # Driver-independent stand-in for neo4j.graph.Node, keeping only the
+    # properties the graph builders read.
+    __slots__ = ("element_id", "labels", "_properties")
+
+    def __init__(self, element_id, labels, properties):
+        self.element_id = element_id
+        self.labels = frozenset(labels)
+        self._properties = properties
+
+    def __getitem__(self, key):
+        return self._properties[key]
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+    def __eq__(self, other):
+        return isinstance(other, SpokeNode) and other.element_id == self.element_id
+
+    def __hash__(self):
+        return hash(("node", self.element_id))
+
+
+class SpokeRelationship:
+    # Driver-independent stand-in for neo4j.graph.Relationship.
+    __slots__ = ("element_id", "type", "nodes")
+
+    def __init__(self, element_id, type, start_node, end_node):
+        self.element_id = element_id
+        self.type = type
+        self.nodes = (start_node, end_node)
+
+    @property
+    def start_node(self):
+        return self.nodes[0]
+
+    @property
+    def end_node(self):
+        return self.nodes[1]
+
+    def __eq__(self, other):
+        return isinstance(other, SpokeRelationship) and other.element_id == self.element_id
+
+    def __hash__(self):
+        return hash(("relationship", self.element_id))
+
+
+def relationships_from_maps(node_maps, rel_maps):
+    # Builds records from the {id, labels, <properties>} / {id, type, start,
+    # end} maps returned by the metapath queries. Missing properties come
+    # back as null and are dropped, so node[key] raises KeyError as usual.
+    nodes = {
+        node_map["id"]: SpokeNode(
+            node_map["id"],
+            node_map["labels"],
+            {key: node_map[key] for key in NODE_PROPERTIES if node_map.get(key) is not None},
+        )
+        for node_map in node_maps
+    }
+    return [
+        SpokeRelationship(rel_map["id"], rel_map["type"], nodes[rel_map["start"]], nodes[rel_map["end"]])
+        for rel_map in rel_maps
+    ]
+
+
+def dump_records(records):
+    # Nested records (paths, relationship lists, (node, relationship) tuples)
+    # become nested lists of "n<i>"/"r<i>" references into flat node and
+    # relationship tables, so shared nodes are stored once.
+    nodes = []
+    node_refs = {}
+    rels = []
+    rel_refs = {}
+
+    def node_ref(node):
+        element_id = _element_id(node)
+        if element_id not in node_refs:
+            node_refs[element_id] = len(nodes)
+            properties = {key: node[key] for key in NODE_PROPERTIES if _has_property(node, key)}
+            nodes.append([element_id, sorted(node.labels), properties])
+        return "n{}".format(node_refs[element_id])
+
+    def rel_ref(rel):
+        element_id = _element_id(rel)
+        if element_id not in rel_refs:
+            start_node, end_node = rel.nodes
+            start_ref, end_ref = node_ref(start_node), node_ref(end_node)
+            rel_refs[element_id] = len(rels)
+            rels.append([element_id, rel.type, int(start_ref[1:]), int(end_ref[1:])])
+        return "r{}".format(rel_refs[element_id])
+
+    def dump(item):
+        if _is_path(item):
+            return [rel_ref(rel) for rel in item]
+        if _is_relationship(item):
+            return rel_ref(item)
+        if _is_node(item):
+            return node_ref(item)
+        return [dump(sub_item) for sub_item in item]
+
+    return {"nodes": nodes, "rels": rels, "records": dump(records)}
+
+
+def load_records(payload):
+    nodes = [SpokeNode(element_id, labels, properties) for element_id, labels, properties in payload["nodes"]]
+    rels = [SpokeRelationship(element_id, rel_type, nodes[start], nodes[end]) for element_id, rel_type, start, end in payload["rels"]]
+
+    def load(item):
+        if isinstance(item, str):
+            table = nodes if item[0] == "n" else rels
+            return table[int(item[1:])]
+        return tuple(load(sub_item) for sub_item in item)
+
+    return list(load(payload["records"]))
+
+
+def _element_id(entity):
+    element_id = getattr(entity, "element_id", None)
+    return element_id if element_id is not None else entity.id
+
+
+def _has_property(node, key):
+    try:
+        node[key]
+    except KeyError:
+        return False
+    return True
+
+
+def _is_path(item):
+    return hasattr(item, "relationships") and hasattr(item, "start_node")
+
+
+def _is_relationship(item):
+    return hasattr(item, "type") and hasattr(item, "nodes")
+
+
+def _is_node(item):
+    return hasattr(item, "labels")
@@ -0,0 +1,42 @@
+import os
+import pandas as pd
+import pytest
+from compound_index import BCMM_COMPOUNDS_PATH, DWPC_COMPOUNDS_PATH, compound_index_from_frame
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("csv_path", [BCMM_COMPOUNDS_PATH, DWPC_COMPOUNDS_PATH])
+def test_every_compound_name_resolves_to_itself(csv_path):
+    # Catalogue names may differ only by case or equal another compound's
+    # spoke_name; the exact name must still win over every alias.
+    frame = pd.read_csv(os.path.join(REPO_ROOT, csv_path))
+    index = compound_index_from_frame(frame)
+    rows = frame.drop_duplicates("compound_name").set_index("compound_name")
+    for compound_name in index.compound_names:
+        assert index.resolve(compound_name) == compound_name
+        expected_identifier = rows.spoke_identifier[compound_name]
+        if pd.notna(expected_identifier):
+            assert index.identifier(compound_name) == expected_identifier
+        if "cmp_index" in rows:
+            assert index.column(compound_name) == rows.cmp_index[compound_name]
+
+
+def test_aliases_resolve_when_there_is_no_exact_name():
+    frame = pd.read_csv(os.path.join(REPO_ROOT, DWPC_COMPOUNDS_PATH))
+    index = compound_index_from_frame(frame)
+    assert index.column("deoxycholic acid") == 52
+    assert index.column("Deoxycholic acid") == 30
+    assert index.resolve("  CHOLINE ") == "choline"
+    assert index.resolve("no such compound") is None
+
+
+@pytest.mark.parametrize("csv_path", [BCMM_COMPOUNDS_PATH, DWPC_COMPOUNDS_PATH])
+def test_every_compound_name_is_found_by_search(csv_path):
+    # The selectbox offers only search() results, so a compound sharing an
+    # alias key with another must still be reachable by its own name.
+    index = compound_index_from_frame(pd.read_csv(os.path.join(REPO_ROOT, csv_path)))
+    for compound_name in index.compound_names:
+        assert compound_name in index.search(compound_name)
+    assert index.search("") == index.compound_names